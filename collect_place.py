@@ -23,12 +23,17 @@ from src.world import World
 from src.stream import get_stable_gen, get_grasp_gen, Z_EPSILON
 from src.streams.pick import get_pick_gen_fn
 from src.database import DATABASE_DIRECTORY, PLACE_IR_FILENAME, get_surface_reference_pose, get_place_path
+from src.collection import collect_parallel, save_collection, get_remaining_samples, Checkpoint
 
 # TODO: condition on the object type (but allow a default object)
 # TODO: generalize to any manipulation with a movable entity
 # TODO: extend to pouring
 
-def collect_place(world, object_name, surface_name, grasp_type, args):
+def get_database_path(world, object_name, surface_name, grasp_type):
+    # Shared by the workers, -resume and the merge of the shards
+    return get_place_path(get_body_name(world.robot), surface_name, grasp_type)
+
+def sample_place(world, object_name, surface_name, grasp_type, num_samples, args, shard=0):
     date = get_date()
     #set_seed(args.seed)
 
@@ -43,15 +48,16 @@ def collect_place(world, object_name, surface_name, grasp_type, args):
     grasps = list(grasp_gen_fn(object_name, grasp_type))
 
     robot_name = get_body_name(world.robot)
-    path = get_place_path(robot_name, surface_name, grasp_type)
+    path = get_database_path(world, object_name, surface_name, grasp_type)
     print(SEPARATOR)
     print('Robot name: {} | Object name: {} | Surface name: {} | Grasp type: {} | Filename: {}'.format(
         robot_name, object_name, surface_name, grasp_type, path))
 
     entries = []
+    checkpoint = Checkpoint(path, shard=shard)
     start_time = time.time()
     failures = 0
-    while (len(entries) < args.num_samples) and \
+    while (len(entries) < num_samples) and \
             (elapsed_time(start_time) < args.max_time): #and (failures <= max_failures):
         (rel_pose,) = next(stable_gen)
         if rel_pose is None:
@@ -60,8 +66,9 @@ def collect_place(world, object_name, surface_name, grasp_type, args):
         with LockRenderer(lock=True):
             result = next(ik_ir_gen(object_name, rel_pose, grasp), None)
         if result is None:
+            checkpoint.add_failure()
             print('Failure! | {} / {} [{:.3f}]'.format(
-                len(entries), args.num_samples, elapsed_time(start_time)))
+                len(entries), num_samples, elapsed_time(start_time)))
             failures += 1
             continue
         # TODO: ensure an arm motion exists
@@ -77,14 +84,13 @@ def collect_place(world, object_name, surface_name, grasp_type, args):
             'surface_from_object': multiply(invert(surface_pose), object_pose),
             'base_from_object': multiply(invert(base_pose), object_pose),
         })
+        checkpoint.add_entry(entries[-1])
         print('Success! | {} / {} [{:.3f}]'.format(
-            len(entries), args.num_samples, elapsed_time(start_time)))
+            len(entries), num_samples, elapsed_time(start_time)))
         if has_gui():
             wait_for_user()
+    checkpoint.flush()
     #visualize_database(tool_from_base_list)
-    if not entries:
-        safe_remove(path)
-        return None
 
     # Assuming the kitchen is fixed but the objects might be open world
     data = {
@@ -100,10 +106,27 @@ def collect_place(world, object_name, surface_name, grasp_type, args):
         'failures': failures,
         'successes': len(entries),
     }
+    return path, data
 
-    write_json(path, data)
-    print('Saved', path)
-    return data
+def collect_place(world, object_name, surface_name, grasp_type, args):
+    path = get_database_path(world, object_name, surface_name, grasp_type)
+    num_samples = get_remaining_samples(path, args)
+    return save_collection([sample_place(world, object_name, surface_name, grasp_type,
+                                         num_samples=num_samples, args=args)], args)
+
+def create_world(args, use_gui=False):
+    world = World(use_gui=use_gui, robot_name=args.robot)
+    #dump_body(world.robot)
+    for joint in world.kitchen_joints:
+        world.open_door(joint) # open_door | close_door
+    world.open_gripper()
+    # TODO: sample from set of objects?
+    world.add_body(get_object_name())
+    # TODO: could constrain Eve to be within a torso cone
+    return world
+
+def get_object_name():
+    return '{}_{}_block{}'.format(BLOCK_SIZES[-1], BLOCK_COLORS[0], 0)
 
 ################################################################################
 
@@ -119,28 +142,27 @@ def main():
     #                    help='The name of the problem to solve.')
     parser.add_argument('-max_time', default=10*60, type=float,
                         help='The maximum runtime')
+    parser.add_argument('-num_cores', default=1, type=int,
+                        help='The number of worker processes (all cores when 0).')
     parser.add_argument('-num_samples', default=1000, type=int,
                         help='The number of samples')
+    parser.add_argument('-num_shards', default=0, type=int,
+                        help='The number of shards per job (split by the expected attempts of the jobs when 0).')
+    parser.add_argument('-resume', action='store_true',
+                        help='Resumes from the existing database and checkpoints up to -num_samples entries.')
     parser.add_argument('-robot', default=FRANKA_CARTER, choices=[FRANKA_CARTER, EVE],
                         help='The robot to use.')
     parser.add_argument('-seed', default=None,
                         help='The random seed to use.')
     parser.add_argument('-teleport', action='store_true',
                         help='Uses unit costs')
+    parser.add_argument('-top_up', action='store_true',
+                        help='Collects -num_samples entries in addition to the existing database.')
     parser.add_argument('-visualize', action='store_true',
                         help='When enabled, visualizes planning rather than the world (for debugging).')
     args = parser.parse_args()
 
-    world = World(use_gui=args.visualize, robot_name=args.robot)
-    #dump_body(world.robot)
-    for joint in world.kitchen_joints:
-        world.open_door(joint) # open_door | close_door
-    world.open_gripper()
-    # TODO: sample from set of objects?
-    object_name = '{}_{}_block{}'.format(BLOCK_SIZES[-1], BLOCK_COLORS[0], 0)
-    world.add_body(object_name)
-    # TODO: could constrain Eve to be within a torso cone
-
+    object_name = get_object_name()
     grasp_colors = {
         TOP_GRASP: RED,
         SIDE_GRASP: BLUE,
@@ -155,8 +177,13 @@ def main():
         if surface_name in (OPEN_SURFACES + CABINETS):
             combinations.append((surface_name, SIDE_GRASP))
 
-    # TODO: parallelize
     print('Combinations:', combinations)
+    if args.num_cores != 1:
+        jobs = [(object_name, surface_name, grasp_type) for surface_name, grasp_type in combinations]
+        collect_parallel(create_world, get_database_path, sample_place, jobs, args)
+        return
+
+    world = create_world(args, use_gui=args.visualize)
     wait_for_user('Start?')
     for surface_name, grasp_type in combinations:
         #draw_picks(world, object_name, surface_name, grasp_type, color=grasp_colors[grasp_type])
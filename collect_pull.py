@@ -14,15 +14,20 @@ from pybullet_tools.pr2_primitives import Conf
 from pybullet_tools.utils import wait_for_user, elapsed_time, multiply, \
     invert, get_link_pose, has_gui, write_json, get_body_name, get_link_name, \
     get_joint_name, joint_from_name, get_date, SEPARATOR, safe_remove, link_from_name
-from src.utils import CABINET_JOINTS, DRAWER_JOINTS, KNOBS, ZED_LEFT_JOINTS
+from src.utils import CABINET_JOINTS, DRAWER_JOINTS, KNOBS, ZED_LEFT_JOINTS, FRANKA_CARTER
 from src.world import World
 from src.streams.press import get_press_gen_fn
 from src.streams.pull import get_pull_gen_fn
 from src.database import get_joint_reference_pose, get_pull_path, is_press
+from src.collection import collect_parallel, save_collection, get_remaining_samples, Checkpoint
 
 # TODO: generalize to any manipulation with a fixed entity
 
-def collect_pull(world, joint_name, args):
+def get_database_path(world, joint_name):
+    # Shared by the workers, -resume and the merge of the shards
+    return get_pull_path(get_body_name(world.robot), joint_name)
+
+def sample_pull(world, joint_name, num_samples, args, shard=0):
     date = get_date()
     #set_seed(args.seed)
 
@@ -36,22 +41,24 @@ def collect_pull(world, joint_name, args):
         pull_gen = get_pull_gen_fn(world, collisions=not args.cfree, teleport=args.teleport, learned=False)
         #handle_link, handle_grasp, _ = get_handle_grasp(world, joint)
 
-    path = get_pull_path(robot_name, joint_name)
+    path = get_database_path(world, joint_name)
     print(SEPARATOR)
     print('Robot name {} | Joint name: {} | Filename: {}'.format(robot_name, joint_name, path))
 
     entries = []
+    checkpoint = Checkpoint(path, shard=shard)
     failures = 0
     start_time = time.time()
-    while (len(entries) < args.num_samples) and \
+    while (len(entries) < num_samples) and \
             (elapsed_time(start_time) < args.max_time):
         if is_press(joint_name):
             result = next(press_gen(joint_name), None)
         else:
             result = next(pull_gen(joint_name, open_conf, closed_conf), None) # Open to closed
         if result is None:
+            checkpoint.add_failure()
             print('Failure! | {} / {} [{:.3f}]'.format(
-                len(entries), args.num_samples, elapsed_time(start_time)))
+                len(entries), num_samples, elapsed_time(start_time)))
             failures += 1
             continue
         if not is_press(joint_name):
@@ -66,13 +73,12 @@ def collect_pull(world, joint_name, args):
         entries.append({
             'joint_from_base': multiply(invert(joint_pose), base_pose),
         })
+        checkpoint.add_entry(entries[-1])
         print('Success! | {} / {} [{:.3f}]'.format(
-            len(entries), args.num_samples, elapsed_time(start_time)))
+            len(entries), num_samples, elapsed_time(start_time)))
         if has_gui():
             wait_for_user()
-    if not entries:
-        safe_remove(path)
-        return None
+    checkpoint.flush()
     #visualize_database(joint_from_base_list)
 
     # Assuming the kitchen is fixed but the objects might be open world
@@ -93,10 +99,17 @@ def collect_pull(world, joint_name, args):
             'open_conf': open_conf.values,
             'closed_conf': closed_conf.values,
         })
+    return path, data
+
+def collect_pull(world, joint_name, args):
+    path = get_database_path(world, joint_name)
+    num_samples = get_remaining_samples(path, args)
+    return save_collection([sample_pull(world, joint_name, num_samples=num_samples, args=args)], args)
 
-    write_json(path, data)
-    print('Saved', path)
-    return data
+def create_world(args, use_gui=False):
+    world = World(use_gui=use_gui)
+    world.open_gripper()
+    return world
 
 ################################################################################
 
@@ -108,24 +121,35 @@ def main():
                         help='When enabled, disables collision checking (for debugging).')
     parser.add_argument('-max_time', default=10 * 60, type=float,
                         help='The maximum runtime')
+    parser.add_argument('-num_cores', default=1, type=int,
+                        help='The number of worker processes (all cores when 0).')
     parser.add_argument('-num_samples', default=1000, type=int,
                         help='The number of samples')
+    parser.add_argument('-num_shards', default=0, type=int,
+                        help='The number of shards per job (split by the expected attempts of the jobs when 0).')
+    parser.add_argument('-resume', action='store_true',
+                        help='Resumes from the existing database and checkpoints up to -num_samples entries.')
     parser.add_argument('-seed', default=None,
                         help='The random seed to use.')
     parser.add_argument('-teleport', action='store_true',
                         help='Uses unit costs')
+    parser.add_argument('-top_up', action='store_true',
+                        help='Collects -num_samples entries in addition to the existing database.')
     parser.add_argument('-visualize', action='store_true',
                         help='When enabled, visualizes planning rather than the world (for debugging).')
     args = parser.parse_args()
     # TODO: could record the full trajectories here
 
-    world = World(use_gui=args.visualize)
-    world.open_gripper()
-
     #joint_names = DRAWER_JOINTS + CABINET_JOINTS
     joint_names = ZED_LEFT_JOINTS
     print('Joints:', joint_names)
     print('Knobs:', KNOBS)
+    if args.num_cores != 1:
+        jobs = [(joint_name,) for joint_name in joint_names + KNOBS]
+        collect_parallel(create_world, get_database_path, sample_pull, jobs, args)
+        return
+
+    world = create_world(args, use_gui=args.visualize)
     wait_for_user('Start?')
     for joint_name in joint_names:
         collect_pull(world, joint_name, args)
@@ -0,0 +1,64 @@
+#!/usr/bin/env python2
+
+from __future__ import print_function
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.extend(os.path.abspath(os.path.join(os.getcwd(), d))
+                for d in ['pddlstream', 'ss-pybullet'])
+
+from pybullet_tools.utils import elapsed_time, read_json, write_json
+from src.database import DATABASE_DIRECTORY, get_database_fields, load_database, compact_database, \
+    compile_database
+
+# Reduces each database to its most spread out entries and reports the coverage that is lost
+
+def compact_path(path, args):
+    fields = get_database_fields(path)
+    array = load_database(path, fields, max_entries=None)
+    if len(array) <= args.num_entries:
+        print('{} | Entries: {} | Skipped'.format(os.path.basename(path), len(array)))
+        return None
+    indices, distances = compact_database(array, args.num_entries)
+    print('{} | Entries: {} -> {} | Covering radius: {:.3f} | Mean distance: {:.3f}'.format(
+        os.path.basename(path), len(array), len(indices), distances.max(), distances.mean()))
+    if not args.overwrite:
+        return indices
+    data = read_json(path)
+    data.update({
+        'entries': [data['entries'][index] for index in sorted(indices)],
+        'compacted_from': len(array),
+        'covering_radius': float(distances.max()),
+    })
+    data['successes'] = len(data['entries'])
+    temp_path = path + '.tmp'
+    write_json(temp_path, data)
+    os.rename(temp_path, path)
+    compile_database(path)
+    return indices
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-directory', default=DATABASE_DIRECTORY,
+                        help='The directory containing the databases.')
+    parser.add_argument('-num_entries', default=500, type=int,
+                        help='The maximum number of entries per database.')
+    parser.add_argument('-overwrite', action='store_true',
+                        help='When enabled, overwrites the databases (otherwise only reports the coverage).')
+    args = parser.parse_args()
+
+    start_time = time.time()
+    num_compacted = 0
+    for filename in sorted(os.listdir(args.directory)):
+        path = os.path.abspath(os.path.join(args.directory, filename))
+        if get_database_fields(path) is None:
+            continue
+        if compact_path(path, args) is not None:
+            num_compacted += 1
+    print('Compacted {} databases in {:.3f} seconds'.format(num_compacted, elapsed_time(start_time)))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,33 @@
+#!/usr/bin/env python2
+
+from __future__ import print_function
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.extend(os.path.abspath(os.path.join(os.getcwd(), d))
+                for d in ['pddlstream', 'ss-pybullet'])
+
+from pybullet_tools.utils import elapsed_time
+from src.database import DATABASE_DIRECTORY, compile_databases
+
+# Converts the json databases into memory-mapped numpy arrays (one per robot/surface/grasp or joint)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-directory', default=DATABASE_DIRECTORY,
+                        help='The directory containing the databases.')
+    parser.add_argument('-force', action='store_true',
+                        help='When enabled, recompiles databases that are up to date.')
+    args = parser.parse_args()
+
+    start_time = time.time()
+    compiled_paths = compile_databases(directory=args.directory, force=args.force)
+    for path in compiled_paths:
+        print('Compiled', path)
+    print('Compiled {} databases in {:.3f} seconds'.format(len(compiled_paths), elapsed_time(start_time)))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+#!/usr/bin/env python2
+
+from __future__ import print_function
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.extend(os.path.abspath(os.path.join(os.getcwd(), d))
+                for d in ['pddlstream', 'ss-pybullet'])
+
+from pybullet_tools.utils import elapsed_time, read_json, write_json, get_date, safe_remove
+from src.database import RECORD_DIRECTORY, RECORD_EXTENSION, MERGE_TOLERANCE, get_database_path, \
+    get_database_fields, read_records, deduplicate_entries, compile_database
+
+# Merges the stream successes recorded with run_pybullet.py -record_successes into the databases
+
+def merge_path(record_path, args):
+    path = get_database_path(record_path)
+    fields = get_database_fields(path)
+    if fields is None:
+        return None
+    data = read_json(path) if os.path.exists(path) else {'failures': 0}
+    entries = data.get('entries', [])
+    records = read_records(record_path)
+    new_entries = deduplicate_entries(entries, records, fields, tolerance=args.tolerance)
+    print('{} | Entries: {} | Recorded: {} | Added: {}'.format(
+        os.path.basename(path), len(entries), len(records), len(new_entries)))
+    if not args.overwrite:
+        return new_entries
+    if new_entries:
+        data.update({
+            'date': get_date(),
+            'entries': entries + new_entries,
+            'recorded': data.get('recorded', 0) + len(new_entries),
+        })
+        data['successes'] = len(data['entries'])
+        temp_path = path + '.tmp'
+        write_json(temp_path, data)
+        os.rename(temp_path, path)
+        compile_database(path)
+    safe_remove(record_path)
+    return new_entries
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-directory', default=RECORD_DIRECTORY,
+                        help='The directory containing the recorded successes.')
+    parser.add_argument('-overwrite', action='store_true',
+                        help='When enabled, updates the databases and removes the merged records.')
+    parser.add_argument('-tolerance', default=MERGE_TOLERANCE, type=float,
+                        help='The distance below which a recorded entry is a duplicate.')
+    args = parser.parse_args()
+
+    start_time = time.time()
+    num_added = 0
+    if os.path.exists(args.directory):
+        for filename in sorted(os.listdir(args.directory)):
+            if filename.endswith(RECORD_EXTENSION):
+                new_entries = merge_path(os.path.join(args.directory, filename), args)
+                num_added += len(new_entries or [])
+    print('Added {} entries in {:.3f} seconds'.format(num_added, elapsed_time(start_time)))
+
+if __name__ == '__main__':
+    main()
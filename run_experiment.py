@@ -43,6 +43,8 @@ from src.observe import observe_pybullet
 from src.world import World
 from src.policy import run_policy
 from src.task import cook_block, TASKS_FNS
+from src.database import compile_databases
+from src.failures import FAILURES
 from run_pybullet import create_parser
 
 from multiprocessing import Pool, TimeoutError, cpu_count
@@ -182,6 +184,7 @@ def run_experiment(experiment):
     if not VERBOSE:
        sys.stdout = open(os.devnull, 'w')
        stdout = sys.stdout
+       FAILURES.verbose = False # Only counts
     if not SERIAL:
         current_wd = os.getcwd()
         # trial_wd = os.path.join(current_wd, TEMP_DIRECTORY, '{}/'.format(os.getpid()))
@@ -228,7 +231,7 @@ def run_experiment(experiment):
     outcome = dict(ERROR_OUTCOME)
     try:
         with timeout(MAX_TIME + TIME_BUFFER):
-            outcome = run_policy(task, args, observation_fn, transition_fn, max_time=MAX_TIME, **policy)
+            outcome = run_policy(task, args, observation_fn, transition_fn, max_time=MAX_TIME, trial=trial, **policy)
             outcome['error'] = False
     except KeyboardInterrupt:
         raise KeyboardInterrupt()
@@ -313,6 +316,8 @@ def main():
     user_input('Begin?')
     print(SEPARATOR)
 
+    # Workers memory-map the same compiled databases
+    print('Compiled:', compile_databases())
     print('Creating problems')
     start_time = time.time()
     problems = create_problems(args)
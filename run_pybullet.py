@@ -20,12 +20,19 @@ from src.planner import VIDEO_TEMPLATE
 from src.world import World
 from src.task import TASKS_FNS
 from src.policy import run_policy
+from src.profiling import PROFILE_MODES, PROFILE_PHASES, OFF
+from src.streams.move import BASE_PLANNERS, BASE_PLANNER
+import src.database
 #from src.debug import dump_link_cross_sections, test_rays
 
 def create_parser():
     parser = argparse.ArgumentParser()
     parser.add_argument('-anytime', action='store_true',
                         help='Runs the planner in an anytime mode.')
+    parser.add_argument('-base_planner', default=BASE_PLANNER, choices=BASE_PLANNERS,
+                        help='The base motion planner (roadmap and lattice fall back to rrt).')
+    parser.add_argument('-budget', action='store_true',
+                        help='When enabled, sets the planning time limits from the past planning times.')
     parser.add_argument('-cfree', action='store_true',
                         help='When enabled, disables collision checking (for debugging).')
     #parser.add_argument('-defer', action='store_true',
@@ -34,16 +41,30 @@ def create_parser():
                         help='Treats actions as having deterministic effects.')
     parser.add_argument('-fixed', action='store_true',
                         help="When enabled, fixes the robot's base.")
+    parser.add_argument('-library', action='store_true',
+                        help='When enabled, first attempts the skeletons that previously solved the task.')
     parser.add_argument('-max_time', default=5*60, type=int,
                         help='The max computation time across execution.')
+    parser.add_argument('-monitor', action='store_true',
+                        help='When enabled, continues executing the previous plan while its preconditions hold.')
     parser.add_argument('-num', default=1, type=int,
                         help='The number of objects (when applicable).')
     parser.add_argument('-observable', action='store_true',
                         help='Treats the state as being fully observable.')
+    parser.add_argument('-portfolio', default=0, type=int,
+                        help='The number of forked planner processes (requires a DIRECT planning world).')
+    parser.add_argument('-profile', default=OFF, choices=PROFILE_MODES,
+                        help='The profiling mode.')
+    parser.add_argument('-profile_phases', nargs='*', default=PROFILE_PHASES, choices=PROFILE_PHASES,
+                        help='The phases to profile.')
     #parser.add_argument('-seed', default=None,
     #                    help='The random seed to use.')
+    parser.add_argument('-serialize', action='store_true',
+                        help='When enabled, plans for growing prefixes of the ordered goals.')
     parser.add_argument('-simulate', action='store_true',
                         help='When enabled, trajectories are simulated')
+    parser.add_argument('-speculate', action='store_true',
+                        help='When enabled, plans from the predicted belief while the plan prefix executes.')
     parser.add_argument('-teleport', action='store_true',
                         help='When enabled, transit motion planning is skipped (for debugging).')
     parser.add_argument('-unit', action='store_true',
@@ -64,7 +85,11 @@ def main():
     parser.add_argument('-record', action='store_true',
                         help='When enabled, records and saves a video at {}'.format(
                             VIDEO_TEMPLATE.format('<problem>')))
+    parser.add_argument('-record_successes', action='store_true',
+                        help='When enabled, records successful pick/pull/press samples to {}'.format(
+                            src.database.RECORD_DIRECTORY))
     args = parser.parse_args()
+    src.database.RECORD_SUCCESSES = args.record_successes
     #if args.seed is not None:
     #    set_seed(args.seed)
     #set_random_seed(0) # Doesn't ensure deterministic
@@ -114,7 +139,7 @@ def main():
         return simulate_commands(real_state, commands)
         #return iterate_commands(real_state, commands, time_step=time_step, pause=False)
 
-    run_policy(task, args, observation_fn, transition_fn)
+    run_policy(task, args, observation_fn, transition_fn, serialize=args.serialize)
 
     if video:
         print('Saved', video_path)
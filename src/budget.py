@@ -0,0 +1,77 @@
+from __future__ import print_function
+
+import os
+
+import numpy as np
+
+from pybullet_tools.utils import read_json, INF
+from src.utils import update_json
+
+CONSTRAINED = 'constrained'
+UNCONSTRAINED = 'unconstrained'
+
+# Absolute because run_experiment.py changes the working directory
+BUDGET_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'budgets.json')
+MAX_HISTORY = 100 # Most recent attempts kept per task and attempt type
+MIN_SUCCESSES = 5 # Before which the default budgets are used
+BUDGET_QUANTILE = 0.9
+BUDGET_MARGIN = 1.5
+MIN_BUDGET = 5 # Seconds
+
+def get_budget_key(task_name, kind):
+    return '{}|{}'.format(task_name, kind)
+
+class BudgetController(object):
+    # Planning time limits per (task, attempt type) from a quantile of the past successful planning times
+    def __init__(self, path=BUDGET_PATH, quantile=BUDGET_QUANTILE, margin=BUDGET_MARGIN,
+                 min_successes=MIN_SUCCESSES, min_budget=MIN_BUDGET, adaptive=True):
+        self.path = path
+        self.quantile = quantile
+        self.margin = margin
+        self.min_successes = min_successes
+        self.min_budget = min_budget
+        self.adaptive = adaptive
+        self.history = {} # key -> [(time, success)]
+        self.new_attempts = {}
+        if os.path.exists(self.path):
+            self.history.update({key: [tuple(attempt) for attempt in attempts]
+                                 for key, attempts in read_json(self.path).items()})
+    def get_attempts(self, task_name, kind):
+        key = get_budget_key(task_name, kind)
+        return self.history.get(key, []) + self.new_attempts.get(key, [])
+    def get_budget(self, task_name, kind, default=INF):
+        if not self.adaptive:
+            return default
+        success_times = [runtime for runtime, success in self.get_attempts(task_name, kind) if success]
+        if len(success_times) < self.min_successes:
+            return default
+        budget = self.margin*np.percentile(success_times, 100*self.quantile)
+        return min(default, max(self.min_budget, float(budget)))
+    def record(self, task_name, kind, runtime, success):
+        key = get_budget_key(task_name, kind)
+        self.new_attempts.setdefault(key, []).append((runtime, bool(success)))
+    def save(self):
+        # Merges with the attempts saved by other processes since loading
+        if not self.new_attempts:
+            return None
+        def update_fn(history):
+            for key, attempts in self.new_attempts.items():
+                history[key] = (history.get(key, []) + [list(attempt) for attempt in attempts])[-MAX_HISTORY:]
+                self.history[key] = [tuple(attempt) for attempt in history[key]]
+            return history
+        update_json(self.path, update_fn)
+        self.new_attempts = {}
+        return self.path
+    def get_statistics(self):
+        statistics = {}
+        for key in sorted(set(self.history) | set(self.new_attempts)):
+            task_name, kind = key.split('|')
+            attempts = self.get_attempts(task_name, kind)
+            statistics[key] = {
+                'attempts': len(attempts),
+                'successes': sum(success for _, success in attempts),
+                'budget': self.get_budget(task_name, kind),
+            }
+        return statistics
+    def __repr__(self):
+        return '{}({})'.format(self.__class__.__name__, len(self.history))
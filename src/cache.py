@@ -0,0 +1,149 @@
+from __future__ import print_function
+
+from collections import OrderedDict
+
+from pybullet_tools.pr2_primitives import Conf
+from pybullet_tools.utils import Attachment
+from src.utils import RelPose, Grasp
+
+# Expensive streams whose outputs only depend on their inputs and the kitchen door angles
+CACHED_STREAMS = [
+    'plan-pick', 'plan-pull', 'plan-press', 'plan-pour',
+    'fixed-plan-pick', 'fixed-plan-pull', 'fixed-plan-press', 'fixed-plan-pour',
+]
+STREAM_CACHE_SIZE = 1000 # Number of input signatures
+SIGNATURE_DIGITS = 3 # Millimeters and milliradians
+UNCACHEABLE = object() # None is a valid signature
+
+# Each failure of an input signature adds one to its weight, which decays by NEGATIVE_DECAY per problem.
+# Signatures with a weight of at least NEGATIVE_THRESHOLD are not evaluated.
+NEGATIVE_DECAY = 0.5
+NEGATIVE_THRESHOLD = 0.5
+MIN_WEIGHT = 1e-3
+
+def round_values(values, digits=SIGNATURE_DIGITS):
+    return tuple(round(value, digits) + 0. for value in values) # Converts -0.0 to 0.0
+
+def get_signature(value, digits=SIGNATURE_DIGITS):
+    # Stable identity of a stream input that does not depend on the python object
+    if (value is None) or isinstance(value, (str, int, bool)):
+        return value
+    if isinstance(value, float):
+        return round(value, digits) + 0.
+    if isinstance(value, (tuple, list)):
+        signatures = tuple(get_signature(item, digits) for item in value)
+        return UNCACHEABLE if UNCACHEABLE in signatures else signatures
+    if isinstance(value, Conf):
+        return ('conf', value.body, tuple(value.joints), round_values(value.values, digits))
+    if isinstance(value, Grasp):
+        return ('grasp', value.body_name, value.grasp_type, value.index)
+    if isinstance(value, Attachment):
+        point, quat = value.grasp_pose
+        return ('attachment', value.parent, value.parent_link, value.child,
+                round_values(point, digits), round_values(quat, digits))
+    if isinstance(value, RelPose):
+        if (value.reference_body is None) and not value.confs:
+            return UNCACHEABLE # Defined by the current pose of the body
+        confs = get_signature(value.confs, digits)
+        if confs is UNCACHEABLE:
+            return UNCACHEABLE
+        return ('pose', value.body, value.reference_body, value.reference_link, value.support, confs)
+    return UNCACHEABLE
+
+def get_scene_signature(belief):
+    return tuple(sorted((name, get_signature(conf)) for name, conf in belief.door_confs.items()))
+
+################################################################################
+
+class StreamCache(object):
+    # Least recently used cache of the outputs of generator streams across problems (e.g. replans and restarts)
+    # Entries are keyed by the signatures of the inputs and the door angles, so belief changes invalidate them
+    # Inputs that recently failed are remembered as well, so restarts do not resample the same dead ends
+    def __init__(self, streams=CACHED_STREAMS, max_size=STREAM_CACHE_SIZE,
+                 decay=NEGATIVE_DECAY, threshold=NEGATIVE_THRESHOLD):
+        self.streams = set(streams)
+        self.max_size = max_size
+        self.decay = decay
+        self.threshold = threshold
+        self.scene = None
+        self.outputs = OrderedDict()
+        self.failures = {} # key -> weight
+        self.hits = 0
+        self.misses = 0
+        self.uncacheable = 0
+        self.evictions = 0
+        self.skipped = 0
+    def set_scene(self, belief):
+        self.scene = get_scene_signature(belief)
+    def start_problem(self):
+        for key in list(self.failures):
+            self.failures[key] *= self.decay
+            if self.failures[key] < MIN_WEIGHT:
+                del self.failures[key]
+    def record_failure(self, key):
+        self.failures[key] = self.failures.get(key, 0.) + 1.
+    def is_infeasible(self, key):
+        return self.threshold <= self.failures.get(key, 0.)
+    def get_key(self, name, inputs):
+        signatures = get_signature(inputs)
+        if signatures is UNCACHEABLE:
+            return None
+        return (name, signatures, self.scene)
+    def lookup(self, key):
+        outputs = self.outputs.pop(key, [])
+        self.outputs[key] = outputs # Most recently used
+        while self.max_size < len(self.outputs):
+            self.outputs.popitem(last=False)
+            self.evictions += 1
+        return outputs
+    def iterate(self, key, gen_fn, inputs):
+        outputs = self.lookup(key)
+        # Replays the previous outputs before resuming sampling with a new generator
+        for output in list(outputs):
+            self.hits += 1
+            yield output
+        self.misses += 1
+        succeeded = bool(outputs)
+        failed = False
+        for output in gen_fn(*inputs):
+            if output is None:
+                if not succeeded and not failed:
+                    self.record_failure(key) # Once per generator, however often it is polled
+                    failed = True
+            else:
+                succeeded = True
+                self.failures.pop(key, None)
+                outputs.append(output)
+            yield output
+        if not succeeded and not failed: # e.g. returned without any attempts
+            self.record_failure(key)
+    def wrap_gen_fn(self, name, gen_fn):
+        if name not in self.streams:
+            return gen_fn
+        def wrapped_gen_fn(*inputs):
+            key = self.get_key(name, inputs)
+            if key is None:
+                self.uncacheable += 1
+                return gen_fn(*inputs)
+            if self.is_infeasible(key):
+                self.skipped += 1
+                return iter([])
+            return self.iterate(key, gen_fn, inputs)
+        return wrapped_gen_fn
+    def clear(self):
+        self.outputs.clear()
+        self.failures.clear()
+    def get_statistics(self):
+        return {
+            'size': len(self.outputs),
+            'hits': self.hits,
+            'misses': self.misses,
+            'uncacheable': self.uncacheable,
+            'evictions': self.evictions,
+            'infeasible': sum(self.is_infeasible(key) for key in self.failures),
+            'skipped': self.skipped,
+        }
+    def __repr__(self):
+        return '{}({})'.format(self.__class__.__name__, self.get_statistics())
+
+STREAM_CACHE = StreamCache()
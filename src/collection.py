@@ -0,0 +1,192 @@
+from __future__ import print_function
+
+import json
+import os
+import zlib
+
+from multiprocessing import Pool, cpu_count
+
+from pybullet_tools.utils import read_json, write_json, get_date, safe_remove, set_random_seed, set_numpy_seed, \
+    SEPARATOR
+from src.database import compile_database, get_compiled_path
+
+CHECKPOINT_EXTENSION = '.checkpoint'
+CHECKPOINT_BATCH = 10 # Number of entries appended to the checkpoint at a time
+
+# Each worker process constructs its own DIRECT world once and reuses it across shards
+WORLD = None
+
+def get_checkpoint_path(path, shard=0):
+    return '{}.{}{}'.format(path, shard, CHECKPOINT_EXTENSION)
+
+def get_checkpoint_paths(path):
+    directory, filename = os.path.split(path)
+    if not os.path.exists(directory):
+        return []
+    prefix = filename + '.'
+    shards = []
+    for name in os.listdir(directory):
+        shard = name[len(prefix):-len(CHECKPOINT_EXTENSION)]
+        if name.startswith(prefix) and name.endswith(CHECKPOINT_EXTENSION) and shard.isdigit():
+            shards.append(int(shard))
+    # Numerically rather than lexicographically so the merged order does not depend on the number of shards
+    return [get_checkpoint_path(path, shard) for shard in sorted(shards)]
+
+def remove_checkpoints(path):
+    for checkpoint_path in get_checkpoint_paths(path):
+        safe_remove(checkpoint_path)
+
+class Checkpoint(object):
+    # Append-only journal of the entries collected by one shard
+    def __init__(self, path, shard=0, batch_size=CHECKPOINT_BATCH):
+        self.path = get_checkpoint_path(path, shard)
+        self.batch_size = batch_size
+        self.entries = []
+        self.failures = 0
+    def add_entry(self, entry):
+        self.entries.append(entry)
+        if self.batch_size <= len(self.entries):
+            self.flush()
+    def add_failure(self):
+        self.failures += 1
+    def flush(self):
+        if not self.entries and not self.failures:
+            return
+        with open(self.path, 'a') as f:
+            f.write(json.dumps({'entries': self.entries, 'failures': self.failures}) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        self.entries = []
+        self.failures = 0
+    def __repr__(self):
+        return '{}({})'.format(self.__class__.__name__, self.path)
+
+def read_checkpoints(path):
+    entries = []
+    failures = 0
+    for checkpoint_path in get_checkpoint_paths(path):
+        with open(checkpoint_path, 'r') as f:
+            for line in f:
+                try:
+                    batch = json.loads(line)
+                except ValueError:
+                    break # The last line might be truncated by a crash
+                entries.extend(batch['entries'])
+                failures += batch['failures']
+    return entries, failures
+
+def read_collection(path):
+    if not os.path.exists(path):
+        return [], 0
+    data = read_json(path)
+    return data['entries'], data.get('failures', 0)
+
+def is_incremental(args):
+    return args.resume or args.top_up
+
+def get_remaining_samples(path, args):
+    # -resume collects up to -num_samples entries while -top_up collects -num_samples more entries
+    if not is_incremental(args):
+        remove_checkpoints(path)
+        return args.num_samples
+    entries, _ = read_collection(path)
+    checkpoint_entries, _ = read_checkpoints(path)
+    target_samples = len(entries) + args.num_samples if args.top_up else args.num_samples
+    return max(0, target_samples - len(entries) - len(checkpoint_entries))
+
+################################################################################
+
+def get_shard_sizes(num_samples, num_shards):
+    return [num_samples // num_shards + int(shard < (num_samples % num_shards))
+            for shard in range(num_shards)]
+
+def get_shard_seed(*names):
+    # hash() of a str is salted per process in Python 3
+    return zlib.crc32('-'.join(map(str, names)).encode('utf-8')) & 0xffffffff
+
+def get_expected_attempts(path, num_samples):
+    # Smoothed success rate of the existing database and checkpoints
+    entries, failures = read_collection(path)
+    checkpoint_entries, checkpoint_failures = read_checkpoints(path)
+    successes = len(entries) + len(checkpoint_entries)
+    rate = float(successes + 1) / (successes + failures + checkpoint_failures + 2)
+    return num_samples / rate
+
+def get_num_shards(expected_attempts, num_cores):
+    # Splits the cores among the jobs in proportion to their expected number of attempts
+    total_attempts = sum(expected_attempts)
+    if total_attempts <= 0:
+        return [1 for _ in expected_attempts]
+    return [max(1, int(round(num_cores * attempts / total_attempts))) for attempts in expected_attempts]
+
+def init_worker(create_world, args):
+    global WORLD
+    WORLD = create_world(args)
+
+def get_job_path(job_args):
+    path_fn, inputs = job_args
+    return path_fn(WORLD, *inputs)
+
+def sample_shard(shard_args):
+    sample_fn, inputs, num_samples, shard, seed, args = shard_args
+    set_random_seed(seed)
+    set_numpy_seed(seed)
+    return sample_fn(WORLD, *inputs, num_samples=num_samples, args=args, shard=shard)
+
+################################################################################
+
+def save_collection(collections, args, path=None):
+    # The checkpoints rather than the returned entries are the record of what was collected
+    sampled_paths = {sampled_path for sampled_path, _ in collections}
+    if path is None:
+        [path] = sampled_paths
+    assert sampled_paths == {path}
+    data = dict(collections[0][1])
+    entries, failures = read_collection(path) if is_incremental(args) else ([], 0)
+    checkpoint_entries, checkpoint_failures = read_checkpoints(path)
+    data.update({
+        'date': get_date(),
+        'entries': entries + checkpoint_entries,
+        'failures': failures + checkpoint_failures,
+        'successes': len(entries) + len(checkpoint_entries),
+    })
+    if not data['entries']:
+        safe_remove(path)
+        safe_remove(get_compiled_path(path))
+        remove_checkpoints(path)
+        return None
+    temp_path = path + '.tmp'
+    write_json(temp_path, data)
+    os.rename(temp_path, path)
+    compile_database(path)
+    remove_checkpoints(path)
+    print('Saved {} | Successes: {} | Failures: {}'.format(path, data['successes'], data['failures']))
+    return data
+
+def collect_parallel(create_world, path_fn, sample_fn, jobs, args):
+    # path_fn(world, *inputs) is the database that sample_fn(world, *inputs, ...) writes
+    num_cores = args.num_cores or cpu_count()
+    pool = Pool(processes=num_cores, initializer=init_worker, initargs=(create_world, args))
+    try:
+        paths = pool.map(get_job_path, [(path_fn, inputs) for inputs in jobs], chunksize=1)
+        remaining_samples = [get_remaining_samples(path, args) for path in paths]
+        if args.num_shards:
+            num_shards = [args.num_shards for _ in jobs]
+        else:
+            num_shards = get_num_shards([get_expected_attempts(path, num_samples) for path, num_samples
+                                         in zip(paths, remaining_samples)], num_cores)
+        shards = []
+        for index, inputs in enumerate(jobs):
+            num_samples = remaining_samples[index]
+            for shard, shard_samples in enumerate(get_shard_sizes(num_samples, num_shards[index])):
+                seed = get_shard_seed(args.seed, num_samples, *(tuple(inputs) + (shard,)))
+                shards.append((index, (sample_fn, inputs, shard_samples, shard, seed, args)))
+        print(SEPARATOR)
+        print('Jobs: {} | Shards: {} | Cores: {}'.format(len(jobs), len(shards), num_cores))
+        results = pool.map(sample_shard, [shard_args for _, shard_args in shards], chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+    # Shards are merged in order so the database only depends on the arguments
+    return [save_collection([result for (i, _), result in zip(shards, results) if i == index], args,
+                            path=path) for index, path in enumerate(paths)]
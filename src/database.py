@@ -1,10 +1,17 @@
+import json
 import os
 import random
+import numpy as np
+
+from collections import OrderedDict
+from scipy.spatial import cKDTree
 
 from pybullet_tools.utils import read_json, link_from_name, get_link_pose, multiply, \
     euler_from_quat, draw_point, wait_for_user, set_joint_positions, joints_from_names, parent_link_from_joint, has_gui, \
-    point_from_pose, RED, child_link_from_joint, get_pose, get_point, invert, base_values_from_pose
-from src.utils import GRASP_TYPES, surface_from_name, BASE_JOINTS, joint_from_name, unit_pose, ALL_SURFACES, KNOBS
+    point_from_pose, RED, child_link_from_joint, get_pose, get_point, invert, base_values_from_pose, \
+    get_custom_limits, grow_polygon, write_json
+from src.utils import GRASP_TYPES, surface_from_name, BASE_JOINTS, joint_from_name, unit_pose, ALL_SURFACES, KNOBS, \
+    update_json
 
 DATABASE_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'databases/')
 PLACE_IR_FILENAME = '{robot_name}-{surface_name}-{grasp_type}-place.json'
@@ -12,6 +19,24 @@ PLACE_IR_FILENAME = '{robot_name}-{surface_name}-{grasp_type}-place.json'
 #PRESS_IR_FILENAME = '{robot_name}-{knob_name}-press.json'
 PULL_IR_FILENAME = '{}-{}-pull.json'
 PRESS_IR_FILENAME = '{}-{}-press.json'
+REACHABILITY_FILENAME = '{}-reachability.json'
+RECORD_DIRECTORY = os.path.join(DATABASE_DIRECTORY, 'recorded/')
+RECORD_EXTENSION = '.jsonl'
+RECORD_SUCCESSES = False # Appends the verified pick/pull/press stream outputs to RECORD_DIRECTORY
+MERGE_TOLERANCE = 0.01 # Recorded entries closer than this to an existing entry are duplicates
+STATISTICS_FILENAME = '{}-entry-statistics.json'
+WEIGHTED_SAMPLING = True # Moves database entries up the proximity order by their smoothed success rate
+SUCCESS_PRIOR = (1., 1.) # Beta prior (successes, failures) of each entry
+
+# Compiled databases are memory-mapped so that pool workers share the same pages
+COMPILED_EXTENSION = '.npy'
+PLACE_FIELDS = ['tool_from_base', 'surface_from_object', 'base_from_object']
+PULL_FIELDS = ['joint_from_base']
+POSE_LENGTH = 7 # point + quat
+DATABASE_CACHE_SIZE = 128 # Max number of cached (robot, surface/joint, grasp, field) arrays
+NEARBY_BASES = 25 # Number of base confs nearest to the current base conf that are proposed first
+ANGLE_WEIGHT = 0.25 # Meters per radian when comparing base confs
+MAX_ENTRIES = None # Compacts each loaded database to at most this many entries (None keeps all)
 
 def get_surface_reference_pose(kitchen, surface_name):
     surface = surface_from_name(surface_name)
@@ -28,27 +53,274 @@ def project_base_pose(base_pose):
 
 ################################################################################
 
+# Vectorized versions of multiply, invert, and project_base_pose over (N, 7) arrays of poses
+
+def multiply_quats(quats1, quats2):
+    x1, y1, z1, w1 = np.moveaxis(quats1, -1, 0)
+    x2, y2, z2, w2 = np.moveaxis(quats2, -1, 0)
+    return np.stack([w1*x2 + x1*w2 + y1*z2 - z1*y2,
+                     w1*y2 - x1*z2 + y1*w2 + z1*x2,
+                     w1*z2 + x1*y2 - y1*x2 + z1*w2,
+                     w1*w2 - x1*x2 - y1*y2 - z1*z2], axis=-1)
+
+def rotate_points(quats, points):
+    vectors, scalars = quats[..., :3], quats[..., 3:]
+    cross = 2*np.cross(vectors, points)
+    return points + scalars*cross + np.cross(vectors, cross)
+
+def invert_rows(rows):
+    rows = np.asarray(rows, dtype=np.float64)
+    quats = rows[..., 3:] * [-1, -1, -1, 1]
+    return np.concatenate([-rotate_points(quats, rows[..., :3]), quats], axis=-1)
+
+def multiply_rows(*rows_list):
+    # Broadcasts so that a single pose can be composed with an array of poses
+    rows = np.asarray(rows_list[0], dtype=np.float64)
+    for other in rows_list[1:]:
+        other = np.asarray(other, dtype=np.float64)
+        points = rows[..., :3] + rotate_points(rows[..., 3:], other[..., :3])
+        rows = np.concatenate([points, multiply_quats(rows[..., 3:], other[..., 3:])], axis=-1)
+    return rows
+
+def project_base_rows(rows):
+    rows = np.reshape(rows, (-1, POSE_LENGTH))
+    x, y, _, qx, qy, qz, qw = rows.T
+    theta = np.arctan2(2*(qw*qz + qx*qy), 1 - 2*(qy*qy + qz*qz))
+    return np.column_stack([x, y, theta])
+
+################################################################################
+
+def row_from_pose(pose):
+    point, quat = pose
+    return list(point) + list(quat)
+
+def pose_from_row(row):
+    return (tuple(map(float, row[:3])), tuple(map(float, row[3:])))
+
+def get_database_dtype(fields):
+    return np.dtype([(str(field), np.float64, (POSE_LENGTH,)) for field in fields])
+
+def array_from_entries(entries, fields):
+    array = np.zeros(len(entries), dtype=get_database_dtype(fields))
+    if entries:
+        for field in fields:
+            array[field] = [row_from_pose(entry[field]) for entry in entries]
+    return array
+
+def get_database_fields(path):
+    if path.endswith('-place.json'):
+        return PLACE_FIELDS
+    if path.endswith('-pull.json') or path.endswith('-press.json'):
+        return PULL_FIELDS
+    return None
+
+def get_compiled_path(path):
+    return os.path.splitext(path)[0] + COMPILED_EXTENSION
+
+def is_compiled(path):
+    compiled_path = get_compiled_path(path)
+    if not os.path.exists(compiled_path):
+        return False
+    return not os.path.exists(path) or (os.path.getmtime(path) <= os.path.getmtime(compiled_path))
+
+def compile_database(path, fields=None):
+    if fields is None:
+        fields = get_database_fields(path)
+    array = array_from_entries(read_json(path).get('entries', []), fields)
+    compiled_path = get_compiled_path(path)
+    temp_path = '{}.{}.tmp'.format(compiled_path, os.getpid())
+    with open(temp_path, 'wb') as f:
+        np.save(f, array)
+    os.rename(temp_path, compiled_path) # Atomic for concurrent readers
+    return compiled_path
+
+def compile_databases(directory=DATABASE_DIRECTORY, force=False):
+    compiled_paths = []
+    for filename in sorted(os.listdir(directory)):
+        path = os.path.abspath(os.path.join(directory, filename))
+        if (get_database_fields(path) is None) or (not force and is_compiled(path)):
+            continue
+        compiled_paths.append(compile_database(path))
+    return compiled_paths
+
+def load_database(path, fields, max_entries=MAX_ENTRIES):
+    if is_compiled(path):
+        array = np.load(get_compiled_path(path), mmap_mode='r')
+    elif not os.path.exists(path):
+        array = array_from_entries([], fields)
+    else:
+        try:
+            array = np.load(compile_database(path, fields), mmap_mode='r')
+        except (IOError, OSError): # E.g. a read-only database directory
+            array = array_from_entries(read_json(path).get('entries', []), fields)
+    if (max_entries is not None) and (max_entries < len(array)):
+        # Computed once per database version rather than once per field
+        indices = DATABASE_CACHE.get((path, 'compacted', max_entries), path,
+                                     lambda: np.array(compact_database(array, max_entries)[0], dtype=int))
+        array = array[indices]
+    return array
+
+################################################################################
+
+def get_coverage_features(array, angle_weight=ANGLE_WEIGHT):
+    # The position and heading of each pose field of each entry
+    features = []
+    for field in array.dtype.names:
+        rows = np.reshape(array[field], (-1, POSE_LENGTH))
+        thetas = project_base_rows(rows)[:, 2]
+        features.extend([rows[:, :3], angle_weight*np.column_stack([np.cos(thetas), np.sin(thetas)])])
+    return np.hstack(features)
+
+def farthest_point_sampling(features, num_samples):
+    # Greedily adds the point farthest from the selected points (2-approximation of the k-center cover)
+    num_samples = min(num_samples, len(features))
+    if num_samples <= 0:
+        return [], np.full(len(features), np.inf)
+    centroid = np.mean(features, axis=0)
+    indices = [int(np.argmin(np.linalg.norm(features - centroid, axis=1)))]
+    distances = np.linalg.norm(features - features[indices[0]], axis=1)
+    while len(indices) < num_samples:
+        index = int(np.argmax(distances))
+        indices.append(index)
+        distances = np.minimum(distances, np.linalg.norm(features - features[index], axis=1))
+    return indices, distances
+
+def compact_database(array, max_entries):
+    # Returns the kept indices and the distance from each entry to the nearest kept entry
+    return farthest_point_sampling(get_coverage_features(array), max_entries)
+
+################################################################################
+
+def get_database_version(path):
+    # The compiled database is derived from the json one, so compiling it upon loading is not a change
+    for version_path in [path, get_compiled_path(path)]:
+        if os.path.exists(version_path):
+            return os.path.getmtime(version_path)
+    return None
+
+class DatabaseCache(object):
+    # Least recently used cache of database arrays that is invalidated upon file changes
+    def __init__(self, max_size=DATABASE_CACHE_SIZE):
+        self.max_size = max_size
+        self.values = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    def get(self, key, path, load_fn):
+        version = get_database_version(path)
+        if key in self.values:
+            cached_version, value = self.values.pop(key)
+            if cached_version == version:
+                self.values[key] = (cached_version, value) # Most recently used
+                self.hits += 1
+                return value
+        self.misses += 1
+        value = load_fn()
+        if isinstance(value, np.ndarray):
+            value.flags.writeable = False # Shared across stream generators
+        self.values[key] = (version, value)
+        while self.max_size < len(self.values):
+            self.values.popitem(last=False)
+            self.evictions += 1
+        return value
+    def clear(self):
+        self.values.clear()
+    def get_statistics(self):
+        return {
+            'size': len(self.values),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+    def __repr__(self):
+        return '{}(size={}, hits={}, misses={}, evictions={})'.format(
+            self.__class__.__name__, len(self.values), self.hits, self.misses, self.evictions)
+
+DATABASE_CACHE = DatabaseCache()
+
+################################################################################
+
+def embed_base_values(base_values, angle_weight=ANGLE_WEIGHT):
+    # Embeds theta on a circle to handle wrap around
+    x, y, theta = np.reshape(base_values, (-1, 3)).T
+    return np.column_stack([x, y, angle_weight*np.cos(theta), angle_weight*np.sin(theta)])
+
+class BaseIndex(object):
+    # KD-tree over the (x, y, theta) base values projected from a database
+    def __init__(self, base_values):
+        self.base_values = np.reshape(np.array(base_values, dtype=np.float64), (-1, 3))
+        self.kd_tree = cKDTree(embed_base_values(self.base_values)) if len(self) else None
+    def __len__(self):
+        return len(self.base_values)
+    def within_limits(self, lower_limits, upper_limits):
+        if not len(self):
+            return []
+        within = np.all((lower_limits <= self.base_values) & (self.base_values <= upper_limits), axis=1)
+        return list(np.flatnonzero(within))
+    def nearest(self, base_values, k=1, lower_limits=None, upper_limits=None):
+        k = min(k, len(self))
+        if k == 0:
+            return []
+        _, indices = self.kd_tree.query(embed_base_values(base_values), k=k)
+        indices = list(np.reshape(indices, -1))
+        if (lower_limits is None) or (upper_limits is None):
+            return indices
+        valid = set(self.within_limits(lower_limits, upper_limits))
+        return [index for index in indices if index in valid]
+    def __repr__(self):
+        return '{}({})'.format(self.__class__.__name__, len(self))
+
+def order_base_indices(world, base_values, ordered=True, nearby=NEARBY_BASES):
+    # Proposes base confs within the base limits that are close to the current base conf first
+    index = BaseIndex(base_values)
+    if not ordered:
+        return list(np.random.permutation(len(index)))
+    lower_limits, upper_limits = get_custom_limits(world.robot, world.base_joints, world.custom_limits)
+    indices = index.within_limits(lower_limits, upper_limits)
+    random.shuffle(indices)
+    if nearby and (world.current_bq is not None):
+        nearest = index.nearest(world.current_bq.values, k=nearby,
+                                lower_limits=lower_limits, upper_limits=upper_limits)
+        proposed = set(nearest)
+        indices = nearest + [i for i in indices if i not in proposed]
+    return indices
+
+def order_base_values(world, base_values, **kwargs):
+    base_values = np.reshape(base_values, (-1, 3))
+    return [tuple(map(float, base_values[i])) for i in order_base_indices(world, base_values, **kwargs)]
+
+################################################################################
+
 def get_place_path(robot_name, surface_name, grasp_type):
     return os.path.abspath(os.path.join(DATABASE_DIRECTORY, PLACE_IR_FILENAME.format(
         robot_name=robot_name, surface_name=surface_name, grasp_type=grasp_type)))
 
 def has_place_database(robot_name, surface_name, grasp_type):
-    return os.path.exists(get_place_path(robot_name, surface_name, grasp_type))
+    path = get_place_path(robot_name, surface_name, grasp_type)
+    return os.path.exists(path) or os.path.exists(get_compiled_path(path))
 
 def load_place_entries(robot_name, surface_name, grasp_type):
-    if not has_place_database(robot_name, surface_name, grasp_type):
-        return []
-    return read_json(get_place_path(robot_name, surface_name, grasp_type)).get('entries', [])
+    return load_database(get_place_path(robot_name, surface_name, grasp_type), PLACE_FIELDS)
 
 def load_place_database(robot_name, surface_name, grasp_type, field):
-    return [entry[field] for entry in load_place_entries(robot_name, surface_name, grasp_type)]
+    return DATABASE_CACHE.get((robot_name, surface_name, grasp_type, field),
+                              get_place_path(robot_name, surface_name, grasp_type),
+                              lambda: load_place_entries(robot_name, surface_name, grasp_type)[field])
+
+def load_inverse_database(robot_name, surface_name, grasp_type):
+    def load_fn():
+        entries = load_place_entries(robot_name, surface_name, grasp_type)
+        return multiply_rows(entries['surface_from_object'],
+                             invert_rows(entries['base_from_object'])).reshape(-1, POSE_LENGTH)
+    return DATABASE_CACHE.get((robot_name, surface_name, grasp_type, 'surface_from_base'),
+                              get_place_path(robot_name, surface_name, grasp_type), load_fn)
 
 def load_placements(world, surface_name, grasp_types=GRASP_TYPES):
     # TODO: could also annotate which grasp came with which placement
     placements = []
     for grasp_type in grasp_types:
-        placements.extend(load_place_database(world.robot_name, surface_name, grasp_type,
-                                              field='surface_from_object'))
+        placements.extend(map(pose_from_row, load_place_database(
+            world.robot_name, surface_name, grasp_type, field='surface_from_object')))
     random.shuffle(placements)
     return placements
 
@@ -56,42 +328,52 @@ def load_forward_placements(world, surface_names=ALL_SURFACES, grasp_types=GRASP
     base_from_objects = []
     for surface_name in surface_names:
         for grasp_type in grasp_types:
-            base_from_objects.extend(load_place_database(world.robot_name, surface_name, grasp_type,
-                                                         field='base_from_object'))
+            base_from_objects.extend(map(pose_from_row, load_place_database(
+                world.robot_name, surface_name, grasp_type, field='base_from_object')))
     return base_from_objects
 
-def load_place_base_poses(world, tool_pose, surface_name, grasp_type):
-    # TODO: Gaussian perturbation
+def get_place_base_values(world, tool_pose, surface_name, grasp_type):
     gripper_from_base_list = load_place_database(world.robot_name, surface_name, grasp_type,
                                                  field='tool_from_base')
-    random.shuffle(gripper_from_base_list)
-    handles = []
-    for gripper_from_base in gripper_from_base_list:
-        #world_from_model = get_pose(world.robot)
-        world_from_model = unit_pose()
-        base_values = project_base_pose(multiply(invert(world_from_model), tool_pose, gripper_from_base))
-        #x, y, _ = base_values
-        #_, _, z = get_point(world.floor)
-        #set_joint_positions(world.robot, joints_from_names(world.robot, BASE_JOINTS), base_values)
-        #handles.extend(draw_point(np.array([x, y, z + 0.01]), color=(1, 0, 0), size=0.05))
-        #wait_for_user()
+    #world_from_model = get_pose(world.robot)
+    world_from_model = unit_pose()
+    base_values_list = project_base_rows(multiply_rows(
+        invert_rows(row_from_pose(world_from_model)), row_from_pose(tool_pose), gripper_from_base_list))
+    #handles = []
+    #_, _, z = get_point(world.floor)
+    #for x, y, _ in base_values_list:
+    #    handles.extend(draw_point(np.array([x, y, z + 0.01]), color=(1, 0, 0), size=0.05))
+    #wait_for_user()
+    return base_values_list
+
+def load_place_base_poses(world, tool_pose, surface_name, grasp_type, **kwargs):
+    # TODO: Gaussian perturbation
+    base_values_list = get_place_base_values(world, tool_pose, surface_name, grasp_type)
+    for base_values in order_base_values(world, base_values_list, **kwargs):
         yield base_values
 
+def load_place_base_generator(world, tool_pose, surface_name, grasp_type, **kwargs):
+    base_values_list = get_place_base_values(world, tool_pose, surface_name, grasp_type)
+    path = get_place_path(world.robot_name, surface_name, grasp_type)
+    return create_base_generator(world, path, base_values_list, **kwargs)
+
 def load_inverse_placements(world, surface_name, grasp_types=GRASP_TYPES):
     surface_from_bases = []
     for grasp_type in grasp_types:
-        for entry in load_place_entries(world.robot_name, surface_name, grasp_type):
-            surface_from_bases.append(multiply(entry['surface_from_object'],
-                                               invert(entry['base_from_object'])))
+        surface_from_bases.extend(map(pose_from_row, load_inverse_database(
+            world.robot_name, surface_name, grasp_type)))
     random.shuffle(surface_from_bases)
     return surface_from_bases
 
-def load_pour_base_poses(world, surface_name, **kwargs):
+def load_pour_base_poses(world, surface_name, grasp_types=GRASP_TYPES, **kwargs):
     world_from_surface = get_surface_reference_pose(world.kitchen, surface_name)
-    for surface_from_base in load_inverse_placements(world, surface_name, **kwargs):
-        base_values = project_base_pose(multiply(world_from_surface, surface_from_base))
-        #world.set_base_conf(base_values)
-        #wait_for_user()
+    surface_from_bases = np.concatenate([np.reshape(load_inverse_database(
+        world.robot_name, surface_name, grasp_type), (-1, POSE_LENGTH)) for grasp_type in grasp_types])
+    base_values_list = project_base_rows(multiply_rows(row_from_pose(world_from_surface), surface_from_bases))
+    #for base_values in base_values_list:
+    #    world.set_base_conf(base_values)
+    #    wait_for_user()
+    for base_values in order_base_values(world, base_values_list, **kwargs):
         yield base_values
 
 ################################################################################
@@ -111,26 +393,300 @@ def get_pull_path(robot_name, joint_name):
     return os.path.abspath(os.path.join(DATABASE_DIRECTORY, ir_filename.format(robot_name, joint_name)))
 
 def load_pull_database(robot_name, joint_name):
-    data = {}
     path = get_pull_path(robot_name, joint_name)
-    if os.path.exists(path):
-        data = read_json(path)
-    return [entry['joint_from_base'] for entry in data.get('entries', [])]
+    return DATABASE_CACHE.get((robot_name, joint_name, None, 'joint_from_base'), path,
+                              lambda: load_database(path, PULL_FIELDS)['joint_from_base'])
 
-def load_pull_base_poses(world, joint_name):
+def get_pull_base_values(world, joint_name):
     joint_from_base_list = load_pull_database(world.robot_name, joint_name)
     parent_pose = get_joint_reference_pose(world.kitchen, joint_name)
-    random.shuffle(joint_from_base_list)
-    handles = []
-    for joint_from_base in joint_from_base_list:
-        #world_from_model = get_pose(world.robot)
-        world_from_model = unit_pose()
-        base_values = project_base_pose(multiply(invert(world_from_model), parent_pose, joint_from_base))
-        #set_joint_positions(world.robot, joints_from_names(world.robot, BASE_JOINTS), base_values)
-        #x, y, _ = base_values
-        #handles.extend(draw_point(np.array([x, y, -0.1]), color=(1, 0, 0), size=0.05))
-        yield base_values
+    #world_from_model = get_pose(world.robot)
+    world_from_model = unit_pose()
+    base_values_list = project_base_rows(multiply_rows(
+        invert_rows(row_from_pose(world_from_model)), row_from_pose(parent_pose), joint_from_base_list))
+    #handles = []
+    #for x, y, _ in base_values_list:
+    #    handles.extend(draw_point(np.array([x, y, -0.1]), color=(1, 0, 0), size=0.05))
     #wait_for_user()
+    return base_values_list
+
+def load_pull_base_poses(world, joint_name, **kwargs):
+    base_values_list = get_pull_base_values(world, joint_name)
+    for base_values in order_base_values(world, base_values_list, **kwargs):
+        yield base_values
+
+def load_pull_base_generator(world, joint_name, **kwargs):
+    base_values_list = get_pull_base_values(world, joint_name)
+    path = get_pull_path(world.robot_name, joint_name)
+    return create_base_generator(world, path, base_values_list, **kwargs)
+
+################################################################################
+
+# Convex reachability regions are computed once per database version and stored next to the databases
+
+POLYGON_CACHE = {} # (robot_name, key) -> (version, polygon)
+
+class ConvexPolygon(object):
+    def __init__(self, vertices):
+        self.vertices = np.reshape(np.array(vertices, dtype=np.float64), (-1, 2))
+        self.edges = np.roll(self.vertices, -1, axis=0) - self.vertices
+    def __len__(self):
+        return len(self.vertices)
+    def contains(self, points):
+        # Vectorized over an (N, 2+) array of points
+        points = np.reshape(np.array(points, dtype=np.float64), (-1, np.shape(points)[-1]))[:, :2]
+        if not len(self):
+            return np.zeros(len(points), dtype=bool)
+        differences = points[:, np.newaxis, :] - self.vertices[np.newaxis, :, :]
+        crosses = self.edges[:, 0]*differences[:, :, 1] - self.edges[:, 1]*differences[:, :, 0]
+        return np.all(0 <= crosses, axis=1) | np.all(crosses <= 0, axis=1) # Either orientation
+    def __contains__(self, point):
+        return bool(self.contains(point)[0])
+    def __repr__(self):
+        return '{}({})'.format(self.__class__.__name__, len(self))
+
+def get_reachability_path(robot_name):
+    return os.path.abspath(os.path.join(DATABASE_DIRECTORY, REACHABILITY_FILENAME.format(robot_name)))
+
+def get_databases_version(paths):
+    version = [MAX_ENTRIES]
+    for path in paths:
+        if not os.path.exists(path):
+            path = get_compiled_path(path)
+        if os.path.exists(path):
+            version.append([os.path.basename(path), os.path.getsize(path), os.path.getmtime(path)])
+    return version
+
+def load_reachability_polygon(robot_name, key, paths, points_fn, radius):
+    version = get_databases_version(paths)
+    cache_key = (robot_name, key)
+    if (cache_key in POLYGON_CACHE) and (POLYGON_CACHE[cache_key][0] == version):
+        return POLYGON_CACHE[cache_key][1]
+    reachability_path = get_reachability_path(robot_name)
+    polygons = read_json(reachability_path) if os.path.exists(reachability_path) else {}
+    if (key not in polygons) or (polygons[key]['version'] != version):
+        vertices = grow_polygon(points_fn(), radius=radius)
+        polygons[key] = {
+            'version': version,
+            'vertices': [list(map(float, vertex[:2])) for vertex in vertices],
+        }
+        def update_fn(data):
+            # Keeps the polygons saved by other processes since reading
+            data[key] = polygons[key]
+            return data
+        update_json(reachability_path, update_fn)
+    polygon = ConvexPolygon(polygons[key]['vertices'])
+    POLYGON_CACHE[cache_key] = (version, polygon)
+    return polygon
+
+def load_forward_polygon(world, radius, surface_names=ALL_SURFACES, grasp_types=GRASP_TYPES):
+    key = 'forward|{}|{}|{}'.format(','.join(surface_names), ','.join(grasp_types), radius)
+    paths = [get_place_path(world.robot_name, surface_name, grasp_type)
+             for surface_name in surface_names for grasp_type in grasp_types]
+    return load_reachability_polygon(world.robot_name, key, paths, lambda: list(map(
+        point_from_pose, load_forward_placements(world, surface_names, grasp_types))), radius)
+
+def load_inverse_polygon(world, surface_name, radius, grasp_types=GRASP_TYPES):
+    key = 'inverse|{}|{}|{}'.format(surface_name, ','.join(grasp_types), radius)
+    paths = [get_place_path(world.robot_name, surface_name, grasp_type) for grasp_type in grasp_types]
+    return load_reachability_polygon(world.robot_name, key, paths, lambda: list(map(
+        point_from_pose, load_inverse_placements(world, surface_name, grasp_types))), radius)
+
+def load_joint_polygon(world, joint_name, radius):
+    # Depends on the pose of the kitchen but not on the base limits
+    key = 'joint|{}|{}'.format(joint_name, radius)
+    paths = [get_pull_path(world.robot_name, joint_name)]
+    return load_reachability_polygon(world.robot_name, key, paths, lambda: list(
+        load_pull_base_poses(world, joint_name, ordered=False)), radius)
+
+################################################################################
+
+# Stream successes are recorded to a side database and merged offline using merge_databases.py
+
+def get_record_path(path):
+    return os.path.join(RECORD_DIRECTORY, os.path.splitext(os.path.basename(path))[0] + RECORD_EXTENSION)
+
+def get_database_path(record_path):
+    return os.path.join(DATABASE_DIRECTORY, os.path.splitext(os.path.basename(record_path))[0] + '.json')
+
+def record_entry(path, entry):
+    record_path = get_record_path(path)
+    if not os.path.exists(RECORD_DIRECTORY):
+        os.makedirs(RECORD_DIRECTORY)
+    with open(record_path, 'a') as f: # Appends of a single line are atomic across processes
+        f.write(json.dumps(entry) + '\n')
+    return record_path
+
+def read_records(record_path):
+    entries = []
+    with open(record_path, 'r') as f:
+        for line in f:
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                pass # Truncated line
+    return entries
+
+def record_place(world, pose, grasp, base_conf):
+    # Same entry as collect_place
+    if not RECORD_SUCCESSES or (pose.support not in ALL_SURFACES):
+        return None
+    pose.assign()
+    base_conf.assign()
+    base_pose = get_link_pose(world.robot, world.base_link)
+    object_pose = pose.get_world_from_body()
+    tool_pose = multiply(object_pose, invert(grasp.grasp_pose))
+    surface_pose = get_surface_reference_pose(world.kitchen, pose.support)
+    return record_entry(get_place_path(world.robot_name, pose.support, grasp.grasp_type), {
+        'tool_from_base': multiply(invert(tool_pose), base_pose),
+        'surface_from_object': multiply(invert(surface_pose), object_pose),
+        'base_from_object': multiply(invert(base_pose), object_pose),
+    })
+
+def record_pull(world, joint_name, base_conf):
+    # Same entry as collect_pull
+    if not RECORD_SUCCESSES:
+        return None
+    base_conf.assign()
+    base_pose = get_link_pose(world.robot, world.base_link)
+    joint_pose = get_joint_reference_pose(world.kitchen, joint_name)
+    return record_entry(get_pull_path(world.robot_name, joint_name), {
+        'joint_from_base': multiply(invert(joint_pose), base_pose),
+    })
+
+def deduplicate_entries(entries, new_entries, fields, tolerance=MERGE_TOLERANCE):
+    # Returns the new entries that are not within tolerance of an existing or previously kept entry
+    if not new_entries:
+        return []
+    new_features = get_coverage_features(array_from_entries(new_entries, fields))
+    kd_tree = cKDTree(get_coverage_features(array_from_entries(entries, fields))) if entries else None
+    unique_entries = []
+    unique_features = []
+    for entry, features in zip(new_entries, new_features):
+        if (kd_tree is not None) and (kd_tree.query(features)[0] < tolerance):
+            continue
+        if unique_features and (np.min(np.linalg.norm(np.array(unique_features) - features, axis=1)) < tolerance):
+            continue
+        unique_entries.append(entry)
+        unique_features.append(features)
+    return unique_entries
+
+################################################################################
+
+# Attempt and success counts of each database entry, persisted across runs
+
+ENTRY_STATISTICS = {} # path -> EntryStatistics
+
+class EntryStatistics(object):
+    def __init__(self, path, num_entries):
+        self.path = path
+        self.version = get_databases_version([path])
+        self.attempts = np.zeros(num_entries, dtype=int)
+        self.successes = np.zeros(num_entries, dtype=int)
+        self.new_attempts = np.zeros(num_entries, dtype=int)
+        self.new_successes = np.zeros(num_entries, dtype=int)
+    @property
+    def name(self):
+        return os.path.basename(self.path)
+    def __len__(self):
+        return len(self.attempts)
+    def update(self, index, success=False):
+        counts = self.new_successes if success else self.new_attempts
+        counts[index] += 1
+    def get_rates(self, prior=SUCCESS_PRIOR):
+        # Posterior mean of the Beta-smoothed success rate
+        successes = self.successes + self.new_successes
+        attempts = np.maximum(self.attempts + self.new_attempts, successes)
+        alpha, beta = prior
+        return (successes + alpha) / (attempts + alpha + beta)
+    def load(self, data):
+        if (data.get('version') == self.version) and (len(data['attempts']) == len(self)):
+            self.attempts = np.array(data['attempts'], dtype=int)
+            self.successes = np.array(data['successes'], dtype=int)
+    def dump(self, data):
+        # Adds the counts since the last dump to the persisted counts of the same database version
+        self.load(data)
+        self.attempts += self.new_attempts
+        self.successes += self.new_successes
+        self.new_attempts[:] = 0
+        self.new_successes[:] = 0
+        return {
+            'version': self.version,
+            'attempts': self.attempts.tolist(),
+            'successes': self.successes.tolist(),
+        }
+    def __repr__(self):
+        return '{}({}, attempts={}, successes={})'.format(
+            self.__class__.__name__, self.name, np.sum(self.attempts + self.new_attempts),
+            np.sum(self.successes + self.new_successes))
+
+def get_statistics_path(robot_name):
+    return os.path.abspath(os.path.join(DATABASE_DIRECTORY, STATISTICS_FILENAME.format(robot_name)))
+
+def get_robot_name(path):
+    return os.path.basename(path).split('-')[0]
+
+def read_statistics(path):
+    statistics_path = get_statistics_path(get_robot_name(path))
+    return statistics_path, (read_json(statistics_path) if os.path.exists(statistics_path) else {})
+
+def load_entry_statistics(path, num_entries):
+    statistics = ENTRY_STATISTICS.get(path)
+    if (statistics is None) or (len(statistics) != num_entries) or \
+            (statistics.version != get_databases_version([path])):
+        statistics = EntryStatistics(path, num_entries)
+        _, data = read_statistics(path)
+        statistics.load(data.get(statistics.name, {}))
+        ENTRY_STATISTICS[path] = statistics
+    return statistics
+
+def save_entry_statistics():
+    saved_paths = []
+    for statistics in ENTRY_STATISTICS.values():
+        if not np.any(statistics.new_attempts) and not np.any(statistics.new_successes):
+            continue
+        def update_fn(data):
+            data[statistics.name] = statistics.dump(data.get(statistics.name, {}))
+            return data
+        statistics_path = get_statistics_path(get_robot_name(statistics.path))
+        update_json(statistics_path, update_fn)
+        saved_paths.append(statistics_path)
+    return sorted(set(saved_paths))
+
+class BaseGenerator(object):
+    # Infinite generator over the database base confs that remembers the entry it last proposed
+    def __init__(self, base_values, indices, statistics=None):
+        self.base_values = base_values
+        self.indices = np.array(indices, dtype=int)
+        self.statistics = statistics
+        if (self.statistics is not None) and len(self.indices):
+            # Divides the rank of each entry by its success rate, which preserves the order of equal rates
+            rates = self.statistics.get_rates()[self.indices]
+            priorities = np.arange(1, len(self.indices) + 1) / rates
+            self.indices = self.indices[np.argsort(priorities, kind='mergesort')]
+        self.num_ordered = 0
+        self.last_index = None
+    def __iter__(self):
+        return self
+    def __next__(self):
+        if not len(self.indices):
+            raise StopIteration()
+        self.last_index = int(self.indices[self.num_ordered % len(self.indices)])
+        self.num_ordered += 1
+        if self.statistics is not None:
+            self.statistics.update(self.last_index)
+        return tuple(map(float, self.base_values[self.last_index]))
+    next = __next__
+    def record_success(self):
+        if (self.statistics is not None) and (self.last_index is not None):
+            self.statistics.update(self.last_index, success=True)
+    def __repr__(self):
+        return '{}({}, {})'.format(self.__class__.__name__, len(self.indices), self.statistics)
+
+def create_base_generator(world, path, base_values_list, weighted=WEIGHTED_SAMPLING, **kwargs):
+    indices = order_base_indices(world, base_values_list, **kwargs)
+    statistics = load_entry_statistics(path, len(base_values_list)) if weighted else None
+    return BaseGenerator(base_values_list, indices, statistics=statistics)
 
 ################################################################################
 
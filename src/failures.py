@@ -0,0 +1,53 @@
+from __future__ import print_function
+
+from collections import Counter
+
+PRINT_FAILURES = True
+
+KINEMATIC = 'kinematic'
+COLLISION = 'collision'
+PROXIMITY = 'proximity'
+PATH = 'path'
+LIMITS = 'limits'
+IR_EXHAUSTED = 'IR exhausted'
+ATTEMPTS_EXHAUSTED = 'attempts exhausted'
+FAILURE_REASONS = [KINEMATIC, COLLISION, PROXIMITY, PATH, LIMITS, IR_EXHAUSTED, ATTEMPTS_EXHAUSTED]
+
+class FailureCounter(object):
+    # Counts (stream, stage, reason) triples. The stream is set by StreamStatistics while a stream is evaluated
+    def __init__(self, verbose=PRINT_FAILURES):
+        self.verbose = verbose
+        self.stream = None
+        self.counts = Counter()
+    def count(self, stage, reason):
+        # Never prints, for failures within hot loops
+        self.counts[self.stream, stage, reason] += 1
+    def fail(self, stage, reason, **kwargs):
+        assert reason in FAILURE_REASONS
+        self.count(stage, reason)
+        if self.verbose:
+            details = ', '.join('{}={:.5f}'.format(key, value) if isinstance(value, float) else
+                                '{}={}'.format(key, value) for key, value in sorted(kwargs.items()))
+            # Only capitalizes the first letter so that acronyms such as IR are printed unchanged
+            label = stage[:1].upper() + stage[1:]
+            print('{} {} failure{}'.format(label, reason, ' ({})'.format(details) if details else ''))
+    def get_reasons(self):
+        reasons = Counter()
+        for (_, _, reason), count in self.counts.items():
+            reasons[reason] += count
+        return dict(reasons)
+    def get_statistics(self):
+        # Per stream breakdown of the failures by stage and reason
+        statistics = {}
+        for (stream, stage, reason), count in self.counts.items():
+            statistics.setdefault(str(stream), {})['{} {}'.format(stage, reason)] = count
+        return statistics
+    def merge(self, counts):
+        # Adds the counts of another process (e.g. a portfolio worker)
+        self.counts.update(counts)
+    def reset(self):
+        self.counts.clear()
+    def __repr__(self):
+        return '{}({})'.format(self.__class__.__name__, self.get_reasons())
+
+FAILURES = FailureCounter()
@@ -0,0 +1,294 @@
+from __future__ import print_function
+
+import heapq
+import math
+
+import numpy as np
+
+from collections import OrderedDict, namedtuple
+from itertools import count
+from scipy.ndimage import distance_transform_edt
+
+from pybullet_tools.utils import get_aabb, aabb_union, get_custom_limits, get_extend_fn, circular_difference, \
+    BodySaver, INF
+from src.database import ANGLE_WEIGHT
+from src.roadmap import get_edge_waypoints, is_path_free, BASE_RESOLUTIONS
+
+XY_RESOLUTION = 0.1 # Meters per cell
+# Integer cell displacements of the lattice headings
+LATTICE_DIRECTIONS = [
+    (1, 0), (2, 1), (1, 1), (1, 2), (0, 1), (-1, 2), (-1, 1), (-2, 1),
+    (-1, 0), (-2, -1), (-1, -1), (-1, -2), (0, -1), (1, -2), (1, -1), (2, -1),
+]
+NUM_HEADINGS = len(LATTICE_DIRECTIONS)
+STRAIGHT_STEPS = [1, 3] # Forward primitives along the heading
+REVERSE_WEIGHT = 2. # Cost multiplier of driving in reverse
+HEURISTIC_WEIGHT = 1.5 # Weighted A*
+MAX_EXPANSIONS = 25000 # Bounds the planning time
+MAX_LAZY_ITERATIONS = 10 # Searches after paths that collide in 3D
+HEURISTIC_CACHE_SIZE = 32 # Goal cells
+FOOTPRINT_MARGIN = 0.02 # Meters
+Z_CLEARANCE = 1e-2 # Obstacles below this height above the bottom of the base are ignored
+SWEEP_RESOLUTION = (XY_RESOLUTION / 4, math.radians(5))
+
+Primitive = namedtuple('Primitive', ['dx', 'dy', 'heading', 'cost', 'cells'])
+
+LATTICES = {} # key -> BaseLattice
+
+def get_heading_angle(heading):
+    dx, dy = LATTICE_DIRECTIONS[heading]
+    return math.atan2(dy, dx)
+
+def get_lattice_key(world, resolution=XY_RESOLUTION):
+    lower_limits, upper_limits = get_custom_limits(world.robot, world.base_joints[:2], world.custom_limits)
+    limits = [round(value, 3) for value in list(lower_limits) + list(upper_limits)]
+    return 'lattice|{}|{}|{}|{}'.format(world.robot_name, ','.join(sorted(world.environment_bodies)),
+                                        limits, resolution)
+
+def get_footprint(world):
+    # AABB of the base links (without the arm) in the frame of the base joints
+    with BodySaver(world.robot):
+        world.set_base_conf(np.zeros(len(world.base_joints)))
+        return world.get_base_aabb()
+
+def interpolate_waypoints(waypoints, resolution=SWEEP_RESOLUTION):
+    confs = [np.array(waypoints[0])]
+    for q1, q2 in zip(waypoints, waypoints[1:]):
+        q1, q2 = np.array(q1), np.array(q2)
+        num_steps = int(max(1, math.ceil(np.linalg.norm(q2[:2] - q1[:2]) / resolution[0]),
+                            math.ceil(abs(q2[2] - q1[2]) / resolution[1])))
+        confs.extend(q1 + float(i) / num_steps * (q2 - q1) for i in range(1, num_steps + 1))
+    return confs
+
+def get_swept_cells(footprint, waypoints, resolution=XY_RESOLUTION, margin=FOOTPRINT_MARGIN):
+    # Cells (relative to the start cell) whose centers are near the footprint along the waypoints
+    (x0, y0), (x1, y1) = footprint
+    margin += resolution / 2
+    radius = max(np.hypot(x, y) for x in [x0, x1] for y in [y0, y1]) + margin
+    cells = set()
+    for x, y, theta in interpolate_waypoints(waypoints):
+        xs = np.arange(math.ceil((x - radius) / resolution), math.floor((x + radius) / resolution) + 1)
+        ys = np.arange(math.ceil((y - radius) / resolution), math.floor((y + radius) / resolution) + 1)
+        grid_xs, grid_ys = np.meshgrid(xs, ys, indexing='ij')
+        dx, dy = resolution*grid_xs - x, resolution*grid_ys - y
+        local_xs = math.cos(theta)*dx + math.sin(theta)*dy
+        local_ys = -math.sin(theta)*dx + math.cos(theta)*dy
+        inside = (x0 - margin <= local_xs) & (local_xs <= x1 + margin) & \
+                 (y0 - margin <= local_ys) & (local_ys <= y1 + margin)
+        cells.update(zip(grid_xs[inside].tolist(), grid_ys[inside].tolist()))
+    return np.array(sorted(cells), dtype=int).reshape(-1, 2)
+
+def get_primitives(footprint, resolution=XY_RESOLUTION):
+    # Driving straight (forward or in reverse) along the heading and turning in place to adjacent headings
+    primitives = {}
+    for heading in range(NUM_HEADINGS):
+        theta = get_heading_angle(heading)
+        dx, dy = LATTICE_DIRECTIONS[heading]
+        length = resolution*np.hypot(dx, dy)
+        options = [(steps*dx, steps*dy, heading, steps*length) for steps in STRAIGHT_STEPS] + \
+                  [(-dx, -dy, heading, REVERSE_WEIGHT*length)]
+        for turn in [-1, +1]:
+            new_heading = (heading + turn) % NUM_HEADINGS
+            rotation = circular_difference(get_heading_angle(new_heading), theta)
+            options.append((0, 0, new_heading, ANGLE_WEIGHT*abs(rotation)))
+        primitives[heading] = []
+        for mx, my, new_heading, cost in options:
+            waypoints = [(0., 0., theta), (resolution*mx, resolution*my,
+                                           theta + circular_difference(get_heading_angle(new_heading), theta))]
+            primitives[heading].append(Primitive(mx, my, new_heading, cost, get_swept_cells(footprint, waypoints)))
+    return primitives
+
+################################################################################
+
+class BaseLattice(object):
+    # Deterministic weighted A* over (x, y, heading) cells using precomputed primitives and their swept cells
+    # The 2D heuristic only considers the static kitchen and is cached per goal cell
+    # Paths are validated in 3D (e.g. the arm and attachments) and colliding primitives are excluded
+    def __init__(self, world, resolution=XY_RESOLUTION):
+        self.world = world
+        self.resolution = resolution
+        lower_limits, upper_limits = get_custom_limits(world.robot, world.base_joints[:2], world.custom_limits)
+        base_lower, base_upper = get_footprint(world)
+        self.footprint = (tuple(base_lower[:2]), tuple(base_upper[:2]))
+        self.z_range = (base_lower[2], base_upper[2])
+        radius = max(np.hypot(x, y) for x in [base_lower[0], base_upper[0]] for y in [base_lower[1], base_upper[1]])
+        self.origin = np.array(lower_limits) - radius
+        self.shape = tuple(int(size) + 1 for size in np.ceil(
+            (np.array(upper_limits) + radius - self.origin) / resolution))
+        self.lower_cell = self.cell_from_point(lower_limits)
+        self.upper_cell = self.cell_from_point(upper_limits)
+        self.primitives = get_primitives(self.footprint, resolution=resolution)
+        self.footprints = {heading: get_swept_cells(self.footprint, [(0., 0., get_heading_angle(heading))])
+                           for heading in range(NUM_HEADINGS)}
+        self.static_obstacles = world.static_obstacles
+        self.static_grid = self.rasterize(self.static_obstacles)
+        # The base center cannot be closer to the static kitchen than the inscribed radius
+        inscribed_radius = min(-base_lower[0], base_upper[0], -base_lower[1], base_upper[1])
+        self.heuristic_grid = resolution*distance_transform_edt(~self.static_grid) < \
+                              inscribed_radius - np.sqrt(2)*resolution
+        self.heuristics = OrderedDict()
+        self.extend_fn = get_extend_fn(world.robot, world.base_joints, resolutions=BASE_RESOLUTIONS)
+        self.queries = 0
+        self.successes = 0
+        self.expansions = 0
+    def cell_from_point(self, point):
+        return tuple(int(i) for i in np.round((np.array(point[:2]) - self.origin) / self.resolution))
+    def state_from_conf(self, conf):
+        heading = min(range(NUM_HEADINGS), key=lambda h: abs(circular_difference(get_heading_angle(h), conf[2])))
+        return self.cell_from_point(conf) + (heading,)
+    def conf_from_state(self, state):
+        x, y = self.origin + self.resolution*np.array(state[:2])
+        return (x, y, get_heading_angle(state[2]))
+    def in_limits(self, cell):
+        return all(lower <= value <= upper for lower, value, upper in zip(self.lower_cell, cell, self.upper_cell))
+    def in_grid(self, cell):
+        return all(0 <= value < size for value, size in zip(cell, self.shape))
+    def rasterize(self, obstacles):
+        grid = np.zeros(self.shape, dtype=bool)
+        for body, links in obstacles:
+            aabb = get_aabb(body) if links is None else aabb_union(get_aabb(body, link) for link in links)
+            lower, upper = aabb
+            if (upper[2] < self.z_range[0] + Z_CLEARANCE) or (self.z_range[1] < lower[2]):
+                continue
+            lower_cell = np.ceil((np.array(lower[:2]) - self.origin) / self.resolution - 0.5).astype(int)
+            upper_cell = np.floor((np.array(upper[:2]) - self.origin) / self.resolution + 0.5).astype(int)
+            lower_cell = np.maximum(lower_cell, 0)
+            upper_cell = np.minimum(upper_cell, np.array(self.shape) - 1)
+            if np.all(lower_cell <= upper_cell):
+                grid[lower_cell[0]:upper_cell[0] + 1, lower_cell[1]:upper_cell[1] + 1] = True
+        return grid
+    def get_heuristic(self, goal_cell):
+        # Shortest distances to the goal cell along the lattice directions
+        if goal_cell in self.heuristics:
+            self.heuristics[goal_cell] = self.heuristics.pop(goal_cell) # Most recently used
+            return self.heuristics[goal_cell]
+        distances = np.full(self.shape, INF)
+        distances[goal_cell] = 0.
+        queue = [(0., goal_cell)]
+        while queue:
+            distance, cell = heapq.heappop(queue)
+            if distances[cell] < distance:
+                continue
+            for dx, dy in LATTICE_DIRECTIONS:
+                new_cell = (cell[0] + dx, cell[1] + dy)
+                if not self.in_grid(new_cell) or self.heuristic_grid[new_cell]:
+                    continue
+                new_distance = distance + self.resolution*np.hypot(dx, dy)
+                if new_distance < distances[new_cell]:
+                    distances[new_cell] = new_distance
+                    heapq.heappush(queue, (new_distance, new_cell))
+        self.heuristics[goal_cell] = distances
+        while HEURISTIC_CACHE_SIZE < len(self.heuristics):
+            self.heuristics.popitem(last=False)
+        return distances
+    def is_colliding(self, grid, cell, cells):
+        if not len(cells):
+            return False
+        cells = cells + np.array(cell)
+        if (np.min(cells) < 0) or np.any(np.max(cells, axis=0) >= self.shape):
+            return True
+        return grid[cells[:, 0], cells[:, 1]].any()
+    def search(self, start, goal, grid, heuristic, invalid, max_expansions=MAX_EXPANSIONS):
+        # Returns the sequence of (state, primitive index) transitions
+        fn = lambda state: HEURISTIC_WEIGHT*heuristic[state[:2]]
+        if fn(start) == INF:
+            return None
+        counter = count()
+        costs = {start: 0.}
+        parents = {start: None}
+        closed = set()
+        queue = [(fn(start), next(counter), start)]
+        while queue and (len(closed) < max_expansions):
+            _, _, state = heapq.heappop(queue)
+            if state in closed:
+                continue
+            closed.add(state)
+            self.expansions += 1
+            if state == goal:
+                transitions = []
+                while parents[state] is not None:
+                    transitions.append(parents[state])
+                    state = parents[state][0]
+                return transitions[::-1]
+            x, y, heading = state
+            for index, primitive in enumerate(self.primitives[heading]):
+                new_state = (x + primitive.dx, y + primitive.dy, primitive.heading)
+                if ((state, index) in invalid) or (new_state in closed) or not self.in_limits(new_state[:2]):
+                    continue
+                new_cost = costs[state] + primitive.cost
+                if (costs.get(new_state, INF) <= new_cost) or self.is_colliding(grid, state[:2], primitive.cells):
+                    continue
+                costs[new_state] = new_cost
+                parents[new_state] = (state, index)
+                heapq.heappush(queue, (new_cost + fn(new_state), next(counter), new_state))
+        return None
+    def get_segments(self, q1, q2, start, transitions, goal):
+        # Waypoints of the start connection, each primitive, and the goal connection
+        segments = [get_edge_waypoints(q1, self.conf_from_state(start))]
+        for state, index in transitions:
+            primitive = self.primitives[state[2]][index]
+            new_state = (state[0] + primitive.dx, state[1] + primitive.dy, primitive.heading)
+            segments.append([self.conf_from_state(state), self.conf_from_state(new_state)])
+        segments.append(get_edge_waypoints(self.conf_from_state(goal), q2))
+        # Headings are unwrapped so that consecutive waypoints differ by less than pi
+        theta = q1[2]
+        for segment in segments:
+            for i, (x, y, new_theta) in enumerate(segment):
+                theta += circular_difference(new_theta, theta)
+                segment[i] = (x, y, theta)
+        segments[-1][-1] = tuple(q2)
+        return segments
+    def get_path(self, waypoints):
+        path = [tuple(waypoints[0])]
+        for qa, qb in zip(waypoints, waypoints[1:]):
+            path.extend(map(tuple, self.extend_fn(qa, qb)))
+        return path
+    def plan(self, q1, q2, obstacles=set(), attachments=[], max_expansions=MAX_EXPANSIONS):
+        self.queries += 1
+        start, goal = self.state_from_conf(q1), self.state_from_conf(q2)
+        if not self.in_limits(start[:2]) or not self.in_limits(goal[:2]):
+            return None
+        grid = self.static_grid | self.rasterize(set(obstacles) - self.static_obstacles)
+        # The footprints of the start and goal states are validated in 3D instead
+        for state in [start, goal]:
+            cells = self.footprints[state[2]] + np.array(state[:2])
+            cells = cells[np.all((0 <= cells) & (cells < np.array(self.shape)), axis=1)]
+            grid[cells[:, 0], cells[:, 1]] = False
+        heuristic = self.get_heuristic(goal[:2])
+        invalid = set()
+        with BodySaver(self.world.robot):
+            for _ in range(MAX_LAZY_ITERATIONS):
+                transitions = self.search(start, goal, grid, heuristic, invalid, max_expansions=max_expansions)
+                if transitions is None:
+                    return None
+                segments = self.get_segments(q1, q2, start, transitions, goal)
+                path = [tuple(q1)]
+                for i, segment in enumerate(segments):
+                    segment_path = self.get_path(segment)
+                    if not is_path_free(self.world, segment_path, obstacles, attachments=attachments,
+                                        attachment_obstacles=obstacles):
+                        if (i == 0) or (i == len(segments) - 1):
+                            return None # Connections to the lattice
+                        invalid.add(transitions[i - 1])
+                        break
+                    path.extend(segment_path[1:])
+                else:
+                    self.successes += 1
+                    return path
+        return None
+    def get_statistics(self):
+        return {
+            'shape': self.shape,
+            'heuristics': len(self.heuristics),
+            'queries': self.queries,
+            'successes': self.successes,
+            'expansions': self.expansions,
+        }
+    def __repr__(self):
+        return '{}({})'.format(self.__class__.__name__, self.get_statistics())
+
+def load_lattice(world, **kwargs):
+    key = get_lattice_key(world, **kwargs)
+    if key not in LATTICES:
+        LATTICES[key] = BaseLattice(world, **kwargs)
+    return LATTICES[key]
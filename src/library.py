@@ -0,0 +1,85 @@
+from __future__ import print_function
+
+import os
+
+from pddlstream.algorithms.constraints import WILD
+from pddlstream.language.constants import Action
+from pybullet_tools.utils import read_json, get_date
+from src.replan import is_optimistic
+from src.stream import get_door_test, OPEN, CLOSED
+from src.utils import update_json
+
+# Absolute because run_experiment.py changes the working directory
+LIBRARY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'skeletons.json')
+MAX_CANDIDATES = 2 # Library skeletons attempted before searching without constraints
+MAX_SKELETONS = 25 # Per task
+
+def get_abstract_belief(belief):
+    # Which objects are on which surfaces, which doors are open, and what is held
+    world = belief.world
+    door_test = get_door_test(world)
+    surfaces = []
+    for name in sorted(belief.pose_dists):
+        surface_dist = belief.pose_dists[name].surface_dist
+        surfaces.append([name, max(sorted(surface_dist.support()), key=surface_dist.prob)])
+    doors = [[name, CLOSED if door_test(name, conf, CLOSED) else OPEN]
+             for name, conf in sorted(belief.door_confs.items())]
+    return [surfaces, doors, belief.holding, sorted(map(list, belief.liquid))]
+
+def skeleton_from_plan(plan):
+    # Only the symbolic arguments persist across runs
+    return [[action.name, [arg if isinstance(arg, str) and not is_optimistic(arg) else None for arg in action.args]]
+            for action in plan if isinstance(action, Action)]
+
+def plan_skeleton(skeleton):
+    return [Action(name, [WILD if arg is None else arg for arg in args]) for name, args in skeleton]
+
+def update_library(library, task_name, belief, skeleton, success):
+    entries = library.setdefault(task_name, [])
+    for entry in entries:
+        if (entry['belief'] == belief) and (entry['skeleton'] == skeleton):
+            break
+    else:
+        if not success:
+            return None
+        entry = {'belief': belief, 'skeleton': skeleton, 'successes': 0, 'failures': 0}
+        entries.append(entry)
+    entry['successes' if success else 'failures'] += 1
+    entry['date'] = get_date()
+    # Keeps the most successful skeletons
+    entries.sort(key=get_success_rate, reverse=True)
+    del entries[MAX_SKELETONS:]
+    return entry
+
+def get_success_rate(entry):
+    return float(entry['successes'] + 1) / (entry['successes'] + entry['failures'] + 2)
+
+class SkeletonLibrary(object):
+    # Successful skeletons indexed by the task and the abstract belief the plan started from
+    def __init__(self, path=LIBRARY_PATH, max_candidates=MAX_CANDIDATES):
+        self.path = path
+        self.max_candidates = max_candidates
+        self.library = read_json(self.path) if os.path.exists(self.path) else {}
+        self.updates = []
+    def get_skeletons(self, task_name, belief):
+        entries = [entry for entry in self.library.get(task_name, []) if entry['belief'] == belief]
+        entries.sort(key=get_success_rate, reverse=True)
+        return [entry['skeleton'] for entry in entries[:self.max_candidates]]
+    def record(self, task_name, belief, skeleton, success):
+        update = (task_name, belief, skeleton, success)
+        self.updates.append(update)
+        return update_library(self.library, *update)
+    def save(self):
+        # Reapplies the updates to the library saved by other processes since loading
+        if not self.updates:
+            return None
+        def update_fn(library):
+            for update in self.updates:
+                update_library(library, *update)
+            return library
+        self.library = update_json(self.path, update_fn)
+        self.updates = []
+        return self.path
+    def __repr__(self):
+        return '{}({})'.format(self.__class__.__name__, {task_name: len(entries)
+                                                        for task_name, entries in self.library.items()})
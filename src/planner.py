@@ -1,7 +1,5 @@
 from __future__ import print_function
 
-import cProfile
-import pstats
 import math
 
 #from examples.discrete_belief.run import MAX_COST
@@ -131,8 +129,20 @@ def create_ordered_skeleton(skeleton):
             last_step = step
     return [OrderedSkeleton(skeleton, orders)]
 
+def get_planner_config(args):
+    # TODO: option to only consider costs during local optimization
+    # effort_weight = 0 if args.anytime else 1
+    #effort_weight = 0
+    #effort_weight = None
+    return {
+        'planner': 'ff-astar' if args.anytime else 'ff-wastar2',
+        'effort_weight': 1e-3 if args.anytime else 1,
+        'search_sample_ratio': 0.5, # 0.5
+        'max_planner_time': 10,
+    }
+
 def solve_pddlstream(belief, problem, args, skeleton=None, replan_actions=set(),
-                     max_time=INF, max_memory=MAX_MEMORY, max_cost=INF):
+                     max_time=INF, max_memory=MAX_MEMORY, max_cost=INF, config=None):
     set_cost_scale(COST_SCALE)
     reset_globals()
     stream_info = get_stream_info()
@@ -143,39 +153,30 @@ def solve_pddlstream(belief, problem, args, skeleton=None, replan_actions=set(),
     constraints = PlanConstraints(skeletons=skeletons, max_cost=max_cost, exact=True)
 
     success_cost = 0 if args.anytime else INF
-    planner = 'ff-astar' if args.anytime else 'ff-wastar2'
-    search_sample_ratio = 0.5 # 0.5
-    max_planner_time = 10
+    if config is None:
+        config = get_planner_config(args)
+    print('Config:', config)
     # TODO: max number of samples per iteration flag
     # TODO: don't greedily expand samples with too high of a complexity if out of time
 
-    pr = cProfile.Profile()
-    pr.enable()
     saver = WorldSaver()
     sim_state = belief.sample_state()
     sim_state.assign()
     wait_for_duration(0.1)
     with LockRenderer(lock=not args.visualize):
-        # TODO: option to only consider costs during local optimization
-        # effort_weight = 0 if args.anytime else 1
-        effort_weight = 1e-3 if args.anytime else 1
-        #effort_weight = 0
-        #effort_weight = None
         solution = solve_focused(problem, constraints=constraints, stream_info=stream_info,
                                  replan_actions=replan_actions, initial_complexity=5,
-                                 planner=planner, max_planner_time=max_planner_time,
+                                 planner=config['planner'], max_planner_time=config['max_planner_time'],
                                  unit_costs=args.unit, success_cost=success_cost,
                                  max_time=max_time, max_memory=max_memory, verbose=True, debug=False,
-                                 unit_efforts=True, effort_weight=effort_weight, max_effort=INF,
+                                 unit_efforts=True, effort_weight=config['effort_weight'], max_effort=INF,
                                  # bind=True, max_skeletons=None,
-                                 search_sample_ratio=search_sample_ratio)
+                                 search_sample_ratio=config['search_sample_ratio'])
         saver.restore()
 
     # print([(s.cost, s.time) for s in SOLUTIONS])
     # print(SOLUTIONS)
     print_solution(solution)
-    pr.disable()
-    pstats.Stats(pr).sort_stats('tottime').print_stats(25)  # cumtime | tottime
     return solution
 
 ################################################################################
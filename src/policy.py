@@ -3,15 +3,25 @@ from __future__ import print_function
 import time
 import traceback
 
+from collections import Counter
+
 from pybullet_tools.utils import wait_for_duration, wait_for_user, \
     print_separator, INF, elapsed_time
 from pddlstream.utils import get_peak_memory_in_kb, str_from_object
 from pddlstream.language.constants import Certificate, PDDLProblem
 from src.belief import create_observable_belief, transition_belief_update, create_observable_pose_dist
-from src.planner import solve_pddlstream, extract_plan_prefix, commands_from_plan
-from src.problem import pdddlstream_from_problem, get_streams
+from src.planner import extract_plan_prefix, commands_from_plan
+from src.portfolio import solve_portfolio, can_fork
+from src.speculation import Speculation
+from src.problem import pdddlstream_from_problem, get_streams, get_serialized_goals
 from src.replan import get_plan_postfix, make_exact_skeleton, reuse_facts, OBSERVATION_ACTIONS, \
-    STOCHASTIC_ACTIONS, make_wild_skeleton
+    STOCHASTIC_ACTIONS, make_wild_skeleton, get_expected_state, is_postfix_valid, compute_plan_cost
+from src.database import DATABASE_CACHE, WEIGHTED_SAMPLING, save_entry_statistics
+from src.cache import STREAM_CACHE
+from src.budget import BudgetController, CONSTRAINED, UNCONSTRAINED
+from src.library import SkeletonLibrary, get_abstract_belief, skeleton_from_plan, plan_skeleton
+from src.profiling import Profiler, StreamStatistics, OBSERVE, UPDATE, PLAN, EXECUTE
+from src.failures import FAILURES
 from src.utils import BOWL, DEBUG
 
 # TODO: max time spent reattempting streams flag (might not be needed actually)
@@ -23,7 +33,8 @@ REPLAN_FAILURES = False
 
 
 def random_restart(belief, args, problem, max_time=INF, max_iterations=INF,
-                   max_planner_time=INF, **kwargs):
+                   max_planner_time=INF, profiler=None, stream_statistics=None, **kwargs):
+    profiler = Profiler() if profiler is None else profiler
     domain_pddl, constant_map, _, _, init, goal_formula = problem
     start_time = time.time()
     task = belief.task
@@ -32,11 +43,16 @@ def random_restart(belief, args, problem, max_time=INF, max_iterations=INF,
     while (elapsed_time(start_time) < max_time) and (iterations < max_iterations):
         iterations += 1
         try:
-            stream_pddl, stream_map = get_streams(world, teleport_base=task.teleport_base,
+            stream_pddl, stream_map = get_streams(world, teleport_base=task.teleport_base, base_planner=args.base_planner,
                                                   collisions=not args.cfree, teleport=args.teleport)
+            if stream_statistics is not None:
+                stream_map = stream_statistics.wrap_stream_map(stream_map)
+            stream_map = profiler.wrap_stream_map(stream_map)
             problem = PDDLProblem(domain_pddl, constant_map, stream_pddl, stream_map, init, goal_formula)
             remaining_time = min(max_time - elapsed_time(start_time), max_planner_time)
-            plan, plan_cost, certificate = solve_pddlstream(belief, problem, args, max_time=remaining_time, **kwargs)
+            plan, plan_cost, certificate = solve_portfolio(belief, problem, args, max_time=remaining_time,
+                                                           profiler=profiler, stream_statistics=stream_statistics,
+                                                           **kwargs)
             if plan is not None:
                 return plan, plan_cost, certificate
         except KeyboardInterrupt as e:
@@ -53,8 +69,90 @@ def random_restart(belief, args, problem, max_time=INF, max_iterations=INF,
         # FastDownward translator runs out of memory
     return None, INF, Certificate(all_facts=[], preimage_facts=[])
 
-def run_policy(task, args, observation_fn, transition_fn, constrain=True, defer=True, # serialize=True,
-               max_time=10*60, max_constrained_time=1.5*60, max_unconstrained_time=INF):
+def plan_belief(belief, args, previous_skeleton=None, previous_facts=[], constrain=True, defer_actions=set(),
+                goals=None, additional_init=[], max_time=INF, max_constrained_time=INF, max_unconstrained_time=INF,
+                profiler=None, stream_statistics=None, counts=None, budgets=None, library=None):
+    profiler = Profiler() if profiler is None else profiler
+    task = belief.task
+    counts = Counter() if counts is None else counts
+    max_restart_time = MAX_RESTART_TIME
+    if budgets is not None:
+        max_constrained_time = budgets.get_budget(task.name, CONSTRAINED, default=max_constrained_time)
+        max_restart_time = budgets.get_budget(task.name, UNCONSTRAINED, default=max_restart_time)
+    start_time = time.time()
+    fixed_base = UNCONSTRAINED_FIXED_BASE or not task.movable_base or not constrain
+    plan, plan_cost = None, INF
+    candidates = [] # (skeleton, facts, library skeleton)
+    if constrain and (previous_skeleton is not None):
+        candidates.append((previous_skeleton, previous_facts, None))
+    elif constrain and (library is not None) and (goals is None):
+        # Skeletons that previously achieved the task from the same abstract belief
+        abstract_belief = get_abstract_belief(belief)
+        candidates.extend((plan_skeleton(skeleton), [], skeleton)
+                          for skeleton in library.get_skeletons(task.name, abstract_belief))
+    for skeleton, facts, library_skeleton in candidates:
+        if (plan is not None) or (max_time <= elapsed_time(start_time)):
+            break
+        # TODO: could constrain by comparing to the previous plan cost
+        counts['constrained'] += 1
+        counts['library'] += (library_skeleton is not None)
+        print_separator(n=25)
+        print('Skeleton:', skeleton)
+        print('Reused facts:', sorted(facts, key=lambda f: f[0]))
+        problem = pdddlstream_from_problem(belief, additional_init=facts, goals=goals, base_planner=args.base_planner,
+                                           collisions=not args.cfree, teleport=args.teleport)
+        planning_time = min(max_time - elapsed_time(start_time), max_constrained_time) #, args.max_time)
+        attempt_start_time = time.time()
+        with profiler.profile(PLAN):
+            plan, plan_cost, certificate = random_restart(belief, args, problem, max_time=planning_time,
+                                                          max_iterations=1, profiler=profiler,
+                                                          stream_statistics=stream_statistics,
+                                                          skeleton=skeleton, replan_actions=defer_actions)
+        if budgets is not None:
+            budgets.record(task.name, CONSTRAINED, elapsed_time(attempt_start_time), plan is not None)
+        if plan is None:
+            print('Failed to solve with plan constraints')
+            if library_skeleton is not None:
+                library.record(task.name, abstract_belief, library_skeleton, success=False)
+            #wait_for_user()
+    #elif not fixed_base:
+    #    num_unconstrained += 1
+    #    problem = pdddlstream_from_problem(belief, additional_init=previous_facts,
+    #                                       collisions=not args.cfree, teleport=args.teleport)
+    #    print_separator(n=25)
+    #    planning_time = min(max_time - elapsed_time(total_start_time)) # , args.max_time)
+    #    plan, plan_cost, certificate = solve_pddlstream(belief, problem, args, max_time=planning_time,
+    #                                                    replan_actions=defer_actions)
+    #    if plan is None:
+    #        print('Failed to solve when allowing fixed base')
+
+    if plan is None:
+        # TODO: might be helpful to add additional facts here in the future
+        counts['unconstrained'] += 1 # additional_init=previous_facts,
+        problem = pdddlstream_from_problem(belief, additional_init=additional_init, fixed_base=fixed_base,
+                                           goals=goals, base_planner=args.base_planner,
+                                           collisions=not args.cfree, teleport=args.teleport)
+        print_separator(n=25)
+        planning_time = min(max_time - elapsed_time(start_time), max_unconstrained_time) #, args.max_time)
+        attempt_start_time = time.time()
+        with profiler.profile(PLAN):
+            plan, plan_cost, certificate = random_restart(belief, args, problem, max_time=planning_time,
+                                                          max_planner_time=max_restart_time,
+                                                          max_iterations=REPLAN_ITERATIONS, profiler=profiler,
+                                                          stream_statistics=stream_statistics,
+                                                          max_cost=plan_cost, replan_actions=defer_actions)
+        if budgets is not None:
+            budgets.record(task.name, UNCONSTRAINED, elapsed_time(attempt_start_time), plan is not None)
+    return plan, plan_cost, certificate, problem
+
+def run_policy(task, args, observation_fn, transition_fn, constrain=True, defer=True, serialize=False,
+               max_time=10*60, max_constrained_time=1.5*60, max_unconstrained_time=INF, trial=0):
+    profiler = Profiler(mode=args.profile, phases=args.profile_phases,
+                        name='{}_t={}'.format(task.name, trial))
+    stream_statistics = StreamStatistics()
+    budgets = BudgetController(adaptive=args.budget)
+    library = SkeletonLibrary()
+    FAILURES.reset()
     replan_actions = OBSERVATION_ACTIONS if args.deterministic else STOCHASTIC_ACTIONS
     defer_actions = replan_actions if defer else set()
     world = task.world
@@ -70,64 +168,90 @@ def run_policy(task, args, observation_fn, transition_fn, constrain=True, defer=
 
     previous_facts = []
     previous_skeleton = None
+    monitored = None # (plan postfix, expected state)
+    # Serialized planning achieves growing prefixes of the ordered goals
+    min_goals = 0
+    previous_goals = None
+    stage_facts = []
     total_start_time = time.time()
     plan_time = 0
     achieved_goal = False
-    num_iterations = num_constrained = num_unconstrained = num_successes = 0
+    num_iterations = num_successes = 0
+    counts = Counter()
+    speculate = args.speculate and can_fork()
+    if args.speculate and not speculate:
+        print('Speculative planning requires forking a DIRECT planning world')
+    speculation = None
+    library_plans = [] # (abstract belief, skeleton) of each plan
     num_actions = num_commands = total_cost = 0
     while elapsed_time(total_start_time) < max_time:
         print_separator(n=50)
         num_iterations += 1
         # TODO: could allow this to be an arbitrary belief transformation
-        observation = observation_fn(belief)
+        with profiler.profile(OBSERVE):
+            observation = observation_fn(belief)
         print('Observation:', observation)
-        belief.update(observation)
+        with profiler.profile(UPDATE):
+            belief.update(observation)
         print('Belief:', belief)
         if DEBUG:
             belief.draw()
 
         #wait_for_user('Plan?')
-        fixed_base = UNCONSTRAINED_FIXED_BASE or not task.movable_base or not constrain
+        goals = get_serialized_goals(belief, min_goals) if serialize else None
+        if goals is not None:
+            print('Goals:', goals)
+        if str(goals) != str(previous_goals):
+            # The previous skeleton achieves different goals
+            previous_skeleton = None
+            previous_facts = []
+            monitored = None
         plan_start_time = time.time()
         plan, plan_cost = None, INF
-        if constrain and (previous_skeleton is not None):
-            # TODO: could constrain by comparing to the previous plan cost
-            num_constrained += 1
-            print_separator(n=25)
-            print('Skeleton:', previous_skeleton)
-            print('Reused facts:', sorted(previous_facts, key=lambda f: f[0]))
-            problem = pdddlstream_from_problem(belief, additional_init=previous_facts,
-                                               collisions=not args.cfree, teleport=args.teleport)
-            planning_time = min(max_time - elapsed_time(total_start_time), max_constrained_time) #, args.max_time)
-            plan, plan_cost, certificate = random_restart(belief, args, problem, max_time=planning_time, max_iterations=1,
-                                                          skeleton=previous_skeleton, replan_actions=defer_actions)
-            if plan is None:
-                print('Failed to solve with plan constraints')
-                #wait_for_user()
-        #elif not fixed_base:
-        #    num_unconstrained += 1
-        #    problem = pdddlstream_from_problem(belief, additional_init=previous_facts,
-        #                                       collisions=not args.cfree, teleport=args.teleport)
-        #    print_separator(n=25)
-        #    planning_time = min(max_time - elapsed_time(total_start_time)) # , args.max_time)
-        #    plan, plan_cost, certificate = solve_pddlstream(belief, problem, args, max_time=planning_time,
-        #                                                    replan_actions=defer_actions)
-        #    if plan is None:
-        #        print('Failed to solve when allowing fixed base')
-
+        if monitored is not None:
+            plan_postfix, expected_state = monitored
+            monitored = None
+            if is_postfix_valid(belief, expected_state, plan_postfix):
+                # Continues executing the bound plan without replanning
+                print('Monitor | Postfix remains valid:', plan_postfix)
+                plan, plan_cost = plan_postfix, compute_plan_cost(plan_postfix)
+                counts['monitored'] += 1
+                if speculation is not None:
+                    speculation.cancel()
+                    speculation = None
+        if speculation is not None:
+            with profiler.profile(PLAN):
+                plan, plan_cost, certificate = speculation.resolve(
+                    belief, max_time=max_time - elapsed_time(total_start_time))
+            speculation = None
+            counts['speculated'] += (plan is not None)
         if plan is None:
-            # TODO: might be helpful to add additional facts here in the future
-            num_unconstrained += 1 # additional_init=previous_facts,
-            problem = pdddlstream_from_problem(belief, fixed_base=fixed_base,
-                                               collisions=not args.cfree, teleport=args.teleport)
-            print_separator(n=25)
-            planning_time = min(max_time - elapsed_time(total_start_time), max_unconstrained_time) #, args.max_time)
-            plan, plan_cost, certificate = random_restart(belief, args, problem, max_time=planning_time,
-                                                          max_planner_time=MAX_RESTART_TIME,
-                                                          max_iterations=REPLAN_ITERATIONS,
-                                                          max_cost=plan_cost, replan_actions=defer_actions)
+            plan, plan_cost, certificate, problem = plan_belief(
+                belief, args, previous_skeleton, previous_facts, constrain=constrain, defer_actions=defer_actions,
+                goals=goals, additional_init=stage_facts, max_time=max_time - elapsed_time(total_start_time),
+                max_constrained_time=max_constrained_time, max_unconstrained_time=max_unconstrained_time,
+                profiler=profiler, stream_statistics=stream_statistics, counts=counts, budgets=budgets,
+                library=library if args.library else None)
+        while (goals is not None) and (plan is not None) and not plan:
+            # The current goals are achieved, so the next goal is added
+            counts['stages'] += 1
+            min_goals = len(goals) + 1
+            goals = get_serialized_goals(belief, min_goals)
+            print('Goals:', goals)
+            plan, plan_cost, certificate, problem = plan_belief(
+                belief, args, constrain=constrain, defer_actions=defer_actions,
+                goals=goals, additional_init=stage_facts, max_time=max_time - elapsed_time(total_start_time),
+                max_constrained_time=max_constrained_time, max_unconstrained_time=max_unconstrained_time,
+                profiler=profiler, stream_statistics=stream_statistics, counts=counts, budgets=budgets,
+                library=library if args.library else None)
 
+        previous_goals = goals
         plan_time += elapsed_time(plan_start_time)
+        print('Database cache:', DATABASE_CACHE)
+        print('Stream cache:', STREAM_CACHE)
+        print('Profiles:', profiler.dump())
+        stream_statistics.dump()
+        print('Failures:', FAILURES)
         #wait_for_duration(elapsed_time(plan_start_time)) # Mocks the real planning time
         if plan is None:
             break
@@ -135,11 +259,27 @@ def run_policy(task, args, observation_fn, transition_fn, constrain=True, defer=
         if not plan:
             achieved_goal = True
             break
+        if goals is None:
+            library_plans.append((get_abstract_belief(belief), skeleton_from_plan(plan)))
         print_separator(n=25)
         plan_prefix = extract_plan_prefix(plan, replan_actions=replan_actions)
         print('Prefix:', plan_prefix)
         # sequences = [plan_prefix]
         sequences = [[action] for action in plan_prefix]
+        if speculate:
+            def plan_fn(predicted_belief):
+                # Assumes that the prefix succeeds
+                skeleton = make_wild_skeleton(world, get_plan_postfix(plan, plan_prefix)) if constrain else None
+                facts = reuse_facts(problem, certificate, skeleton)
+                predicted_goals = get_serialized_goals(predicted_belief, min_goals) if serialize else None
+                if str(predicted_goals) != str(goals):
+                    skeleton, facts = None, []
+                return plan_belief(predicted_belief, args, skeleton, facts, constrain=constrain,
+                                   defer_actions=defer_actions, goals=predicted_goals, additional_init=stage_facts,
+                                   max_time=max_time - elapsed_time(total_start_time),
+                                   max_constrained_time=max_constrained_time,
+                                   max_unconstrained_time=max_unconstrained_time, budgets=budgets)[:3]
+            speculation = Speculation(belief, problem, plan, plan_prefix).start(plan_fn)
 
         success = belief.check_consistent()
         for i, sequence in enumerate(sequences):
@@ -150,11 +290,21 @@ def run_policy(task, args, observation_fn, transition_fn, constrain=True, defer=
             commands = commands_from_plan(world, sequence)
             num_commands += len(commands)
             print('Commands:', commands)
-            success &= transition_fn(belief, commands) and \
-                       transition_belief_update(belief, sequence) and \
-                       belief.check_consistent()
+            with profiler.profile(EXECUTE):
+                success &= transition_fn(belief, commands)
+            with profiler.profile(UPDATE):
+                success = success and transition_belief_update(belief, sequence) and belief.check_consistent()
             total_cost += sum(command.cost for command in commands)
         num_successes += success
+        if success and serialize:
+            # Facts certified for the executed plan are reused by later stages
+            stage_facts = reuse_facts(problem, certificate, make_wild_skeleton(world, get_plan_postfix(plan, [])))
+        if not success and (speculation is not None):
+            speculation.cancel()
+            speculation = None
+        if success and args.monitor and get_plan_postfix(plan, plan_prefix):
+            # An empty postfix is not monitored so that the goal is checked by replanning
+            monitored = (get_plan_postfix(plan, plan_prefix), get_expected_state(belief))
 
         # TODO: store history of stream evaluations
         if success and constrain:
@@ -167,7 +317,19 @@ def run_policy(task, args, observation_fn, transition_fn, constrain=True, defer=
         else:
             previous_skeleton = None
             previous_facts = []
+    if speculation is not None:
+        speculation.cancel()
 
+    if achieved_goal:
+        for abstract_belief, skeleton in library_plans:
+            library.record(task.name, abstract_belief, skeleton, success=True)
+    if WEIGHTED_SAMPLING:
+        save_entry_statistics()
+    if args.budget:
+        budgets.save()
+    if args.library:
+        library.save()
+    print('Library:', library)
     if achieved_goal:
         print('Success!')
     else:
@@ -179,13 +341,23 @@ def run_policy(task, args, observation_fn, transition_fn, constrain=True, defer=
         'total_time': elapsed_time(total_start_time),
         'plan_time': plan_time,
         'num_iterations': num_iterations,
-        'num_constrained': num_constrained,
-        'num_unconstrained': num_unconstrained,
+        'num_constrained': counts['constrained'],
+        'num_unconstrained': counts['unconstrained'],
+        'num_speculated': counts['speculated'],
+        'num_library': counts['library'],
+        'num_stages': counts['stages'],
+        'num_monitored': counts['monitored'],
         'num_successes': num_successes,
         'num_actions': num_actions,
         'num_commands': num_commands,
         'peak_memory': get_peak_memory_in_kb(),
         'total_cost': total_cost,
+        'database_cache': DATABASE_CACHE.get_statistics(),
+        'stream_cache': STREAM_CACHE.get_statistics(),
+        'budgets': budgets.get_statistics(),
+        'profile': profiler.get_statistics(),
+        'streams': stream_statistics.get_statistics(),
+        'failures': FAILURES.get_statistics(),
     }
     print('Data:', str_from_object(data))
     return data
@@ -0,0 +1,291 @@
+from __future__ import print_function
+
+import errno
+import os
+import pickle
+import random
+import select
+import signal
+import struct
+import sys
+import time
+import traceback
+
+from io import BytesIO
+
+from pybullet_tools.utils import has_gui, elapsed_time, ensure_dir, set_random_seed, set_numpy_seed, INF
+from pddlstream.language.constants import Certificate
+from pddlstream.utils import safe_rm_dir
+from src.failures import FAILURES
+from src.planner import solve_pddlstream, get_planner_config
+
+# Overrides of the configuration given by the arguments, which are cycled (with new seeds) across the workers
+PORTFOLIO_CONFIGS = [
+    {},
+    {'planner': 'ff-wastar1'},
+    {'planner': 'ff-wastar4', 'search_sample_ratio': 1},
+    {'planner': 'ff-astar', 'effort_weight': 1e-3},
+    {'planner': 'ff-eager', 'search_sample_ratio': 0.25},
+]
+PORTFOLIO_DIRECTORY = 'temp_portfolio/' # FastDownward writes its temp/ files relative to the working directory
+PORTFOLIO_GRACE = 10 # Seconds for the workers to send their solutions after max_time
+VERBOSE_WORKERS = False # Otherwise, only the first worker prints
+READ_SIZE = 2**16
+HEADER_FORMAT = '!I' # Size of each message
+
+FAILED_SOLUTION = (None, INF, Certificate(all_facts=[], preimage_facts=[]))
+
+################################################################################
+
+def flatten_objects(values):
+    objects = []
+    for value in values:
+        objects.append(value)
+        if isinstance(value, dict):
+            objects.extend(value.keys())
+            objects.extend(value.values())
+        elif isinstance(value, (list, tuple, set, frozenset)):
+            objects.extend(value)
+    return objects
+
+def get_shared_objects(belief, problem, plan=[]):
+    # Objects that exist before the fork have the same id() in the workers.
+    # Solutions refer to these objects rather than copies of them (e.g. the world and belief confs)
+    world = belief.task.world
+    _, constant_map, _, _, init, _ = problem
+    objects = [world, belief.task, belief]
+    objects.extend(flatten_objects(vars(world).values()))
+    objects.extend(flatten_objects(vars(belief).values()))
+    objects.extend(constant_map.values())
+    for fact in init:
+        objects.extend(flatten_objects(fact[1:]))
+    for _, params in plan:
+        objects.extend(flatten_objects(params))
+    return {id(obj): obj for obj in objects}
+
+class SharedPickler(pickle.Pickler):
+    def __init__(self, f, shared):
+        pickle.Pickler.__init__(self, f, pickle.HIGHEST_PROTOCOL)
+        self.shared = shared
+    def persistent_id(self, obj):
+        if (id(obj) in self.shared) and (self.shared[id(obj)] is obj):
+            return id(obj)
+        return None
+
+class SharedUnpickler(pickle.Unpickler):
+    def __init__(self, f, shared):
+        pickle.Unpickler.__init__(self, f)
+        self.shared = shared
+    def persistent_load(self, pid):
+        return self.shared[pid]
+
+################################################################################
+
+def can_fork():
+    # A GUI connection cannot be forked while a DIRECT connection is copied with the process
+    return hasattr(os, 'fork') and not has_gui()
+
+class Worker(object):
+    # Forked process that sends length-prefixed pickled messages (e.g. its result) through a pipe
+    def __init__(self, index, shared, config=None, seed=None, verbose=VERBOSE_WORKERS):
+        self.index = index
+        self.shared = shared
+        self.config = config
+        self.seed = seed
+        self.verbose = verbose
+        self.pid = None
+        self.fd = None
+        self.data = b''
+        self.messages = []
+        self.start_time = None
+    @property
+    def directory(self):
+        return os.path.join(os.path.abspath(PORTFOLIO_DIRECTORY), '{}_w={}/'.format(os.getpid(), self.index))
+    def start(self, fn):
+        directory = self.directory
+        read_fd, write_fd = os.pipe()
+        sys.stdout.flush()
+        self.start_time = time.time()
+        self.pid = os.fork()
+        if self.pid != 0:
+            os.close(write_fd)
+            self.fd = read_fd
+            try:
+                # Also set by the parent so that kill() cannot race with the worker's setpgid
+                os.setpgid(self.pid, self.pid)
+            except OSError as e:
+                if e.errno not in [errno.EACCES, errno.ESRCH]: # The worker already exec'd or exited
+                    raise e
+            return self.pid
+        # The worker never returns from start()
+        status = 1
+        try:
+            os.close(read_fd)
+            self.fd = write_fd
+            os.setpgid(0, 0) # Groups FastDownward with the worker so both can be killed
+            if not self.verbose:
+                sys.stdout = open(os.devnull, 'w')
+            ensure_dir(directory)
+            os.chdir(directory)
+            if self.seed is not None:
+                set_random_seed(self.seed)
+                set_numpy_seed(self.seed)
+            self.send(fn())
+            status = 0
+        except:
+            traceback.print_exc()
+        finally:
+            os._exit(status)
+    def send(self, message):
+        # Called by the worker
+        buffer = BytesIO()
+        SharedPickler(buffer, self.shared).dump(message)
+        data = buffer.getvalue()
+        data = struct.pack(HEADER_FORMAT, len(data)) + data
+        while data:
+            data = data[os.write(self.fd, data):]
+    def read(self):
+        # Returns True once the worker has closed its pipe
+        data = os.read(self.fd, READ_SIZE)
+        if data:
+            self.data += data
+            return False
+        os.close(self.fd)
+        self.fd = None
+        return True
+    def parse(self):
+        header_size = struct.calcsize(HEADER_FORMAT)
+        while header_size <= len(self.data):
+            (size,) = struct.unpack(HEADER_FORMAT, self.data[:header_size])
+            if len(self.data) < header_size + size:
+                break
+            data, self.data = self.data[header_size:header_size + size], self.data[header_size + size:]
+            try:
+                self.messages.append(SharedUnpickler(BytesIO(data), self.shared).load())
+            except Exception:
+                traceback.print_exc()
+    def receive(self):
+        # Returns the messages that have been fully read
+        self.parse()
+        messages, self.messages = self.messages, []
+        return messages
+    def wait(self, timeout=INF):
+        # Returns the next message or None if the worker exits or the timeout is reached
+        start_time = time.time()
+        while True:
+            self.parse()
+            if self.messages:
+                return self.messages.pop(0)
+            remaining_time = timeout - elapsed_time(start_time)
+            if (self.fd is None) or (remaining_time <= 0):
+                return None
+            ready_fds, _, _ = select.select([self.fd], [], [], remaining_time if remaining_time < INF else None)
+            if ready_fds:
+                self.read()
+    def kill(self):
+        if self.pid is None:
+            return
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+        try:
+            os.killpg(self.pid, signal.SIGKILL)
+        except OSError:
+            try:
+                os.kill(self.pid, signal.SIGKILL)
+            except OSError:
+                pass # Already reaped
+        os.waitpid(self.pid, 0)
+        self.pid = None
+        safe_rm_dir(self.directory)
+    def __repr__(self):
+        return '{}({}, {}, seed={})'.format(self.__class__.__name__, self.index, self.config, self.seed)
+
+def create_workers(args, num_workers, shared):
+    base_config = get_planner_config(args)
+    workers = []
+    for index in range(num_workers):
+        config = dict(base_config)
+        config.update(PORTFOLIO_CONFIGS[index % len(PORTFOLIO_CONFIGS)])
+        workers.append(Worker(index, shared, config=config, seed=random.randint(0, 2**32 - 1),
+                              verbose=VERBOSE_WORKERS or (index == 0)))
+    return workers
+
+################################################################################
+
+def get_counters(profiler=None, stream_statistics=None):
+    return {
+        'profiler': profiler.get_statistics() if profiler is not None else {},
+        'streams': stream_statistics.get_statistics() if stream_statistics is not None else {},
+        'failures': dict(FAILURES.counts),
+    }
+
+def reset_counters(profiler=None, stream_statistics=None):
+    # Called by each worker so that it only reports what it counted after the fork
+    if profiler is not None:
+        profiler.reset()
+    if stream_statistics is not None:
+        stream_statistics.reset()
+    FAILURES.reset()
+
+def merge_counters(counters, profiler=None, stream_statistics=None):
+    if profiler is not None:
+        profiler.merge(counters['profiler'])
+    if stream_statistics is not None:
+        stream_statistics.merge(counters['streams'])
+    FAILURES.merge(counters['failures'])
+
+def solve_worker(belief, problem, args, profiler=None, stream_statistics=None, **kwargs):
+    reset_counters(profiler, stream_statistics)
+    solution = solve_pddlstream(belief, problem, args, **kwargs)
+    return solution, get_counters(profiler, stream_statistics)
+
+def solve_portfolio(belief, problem, args, max_time=INF, profiler=None, stream_statistics=None, **kwargs):
+    # Each worker is a fork with its own copy of the DIRECT planning world
+    # Workers send their counters (e.g. stream statistics and failures) with their solution,
+    # so the counters of workers that are killed before they finish are lost
+    num_workers = args.portfolio
+    if num_workers <= 1:
+        return solve_pddlstream(belief, problem, args, max_time=max_time, **kwargs)
+    if not can_fork():
+        print('Portfolio planning requires forking a DIRECT planning world')
+        return solve_pddlstream(belief, problem, args, max_time=max_time, **kwargs)
+    # The anytime mode keeps the best solution by the deadline while otherwise the first solution is returned
+    deadline = max_time + PORTFOLIO_GRACE
+    start_time = time.time()
+    workers = create_workers(args, num_workers, get_shared_objects(belief, problem))
+    for worker in workers:
+        worker.start(lambda config=worker.config: solve_worker(
+            belief, problem, args, profiler=profiler, stream_statistics=stream_statistics,
+            max_time=max_time, config=config, **kwargs))
+    best_worker = None
+    best_solution = FAILED_SOLUTION
+    try:
+        running = {worker.fd: worker for worker in workers}
+        while running and (elapsed_time(start_time) < deadline):
+            timeout = max(0., deadline - elapsed_time(start_time)) if deadline < INF else None
+            ready_fds, _, _ = select.select(list(running), [], [], timeout)
+            for fd in ready_fds:
+                worker = running[fd]
+                if not worker.read():
+                    continue
+                del running[fd]
+                messages = worker.receive()
+                if messages:
+                    solution, counters = messages[-1]
+                    merge_counters(counters, profiler, stream_statistics)
+                else:
+                    solution = FAILED_SOLUTION
+                plan, cost, _ = solution
+                print('Worker {} | Config: {} | Solved: {} | Cost: {:.3f} | Time: {:.3f}'.format(
+                    worker.index, worker.config['planner'], plan is not None, cost, elapsed_time(worker.start_time)))
+                if (plan is not None) and (cost < best_solution[1]):
+                    best_worker, best_solution = worker, solution
+            if (best_worker is not None) and not args.anytime:
+                break
+    finally:
+        for worker in workers:
+            worker.kill()
+    print('Portfolio | Workers: {} | Winner: {} | Time: {:.3f}'.format(
+        num_workers, best_worker, elapsed_time(start_time)))
+    return best_solution
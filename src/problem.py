@@ -1,7 +1,9 @@
 from __future__ import print_function
 
+import hashlib
 import numpy as np
 import math
+import os
 
 from itertools import product
 
@@ -10,6 +12,8 @@ from pddlstream.language.constants import get_args, is_parameter, get_parameter_
 from pddlstream.language.stream import DEBUG
 from pddlstream.language.generator import from_gen_fn, from_fn, from_test
 from pddlstream.utils import read, get_file_path, implies
+from pddlstream.algorithms.algorithm import parse_domain
+from pddlstream.algorithms.downward import get_fluents
 
 from pybullet_tools.utils import get_joint_name, child_link_from_joint, get_link_name, parent_joint_from_link, link_from_name, \
     get_difference_fn, euler_from_quat, quat_from_pose, joint_from_name, dump_body
@@ -28,15 +32,19 @@ from src.stream import get_stable_gen, get_grasp_gen, get_door_test, CLOSED, DOO
     get_sample_belief_gen, detect_cost_fn, get_cfree_bconf_pose_test, \
     get_cfree_worldpose_worldpose_test, get_cfree_worldpose_test, update_belief_fn, \
     get_cfree_angle_angle_test
-from src.streams.move import get_base_motion_fn, get_arm_motion_gen, get_gripper_motion_gen
+from src.streams.move import get_base_motion_fn, get_arm_motion_gen, get_gripper_motion_gen, BASE_PLANNER
 from src.streams.press import get_press_gen_fn, get_fixed_press_gen_fn
 from src.streams.pull import get_fixed_pull_gen_fn, get_pull_gen_fn
 from src.streams.pick import get_fixed_pick_gen_fn, get_pick_gen_fn
 from src.streams.pour import get_fixed_pour_gen_fn, get_pour_gen_fn
 from src.database import has_place_database
+from src.cache import STREAM_CACHE
 
 MAX_ERROR = np.pi / 6
 
+# Serialized goals are planned for in this order of types
+SERIAL_ORDER = ['Localized', 'Open', 'On', 'HasLiquid', 'Cooked', 'Pressed', 'Closed', 'Goal', 'HandEmpty', 'Holding']
+
 def existential_quantification(goal_literals):
     # TODO: merge with pddlstream-experiments
     goal_formula = []
@@ -67,10 +75,50 @@ ACTION_COSTS = {
 def title_from_snake(s):
     return ''.join(x.title() for x in s.split('_'))
 
+# Process-level caches of the pddl files and the objects derived from them
+PDDL_FROM_PATH = {} # path -> (mtime, size, pddl)
+DOMAIN_FROM_HASH = {} # hash -> (domain, fluents)
+
+def read_pddl(relative_path):
+    path = get_file_path(__file__, relative_path)
+    version = (os.path.getmtime(path), os.path.getsize(path))
+    if PDDL_FROM_PATH.get(path, (None, None, None))[:2] != version:
+        PDDL_FROM_PATH[path] = version + (read(path),)
+    return PDDL_FROM_PATH[path][2]
+
+def get_pddl_hash(pddl):
+    return hashlib.sha1(pddl.encode('utf-8')).hexdigest()
+
+def parse_cached_domain(domain_pddl):
+    # The returned domain is shared and must not be modified (solve_focused parses its own copy)
+    key = get_pddl_hash(domain_pddl)
+    if key not in DOMAIN_FROM_HASH:
+        domain = parse_domain(domain_pddl)
+        DOMAIN_FROM_HASH[key] = (domain, frozenset(get_fluents(domain)))
+    return DOMAIN_FROM_HASH[key]
+
+def get_domain_fluents(domain_pddl):
+    _, fluents = parse_cached_domain(domain_pddl)
+    return fluents
+
+def get_stream_key(world, teleport_base=False, **kwargs):
+    # The generators capture the task and the static obstacles when they are constructed
+    return (id(world.task), frozenset(world.environment_bodies), teleport_base, frozenset(kwargs.items()))
+
 def get_streams(world, debug=False, teleport_base=False, **kwargs):
-    stream_pddl = read(get_file_path(__file__, '../pddl/stream.pddl'))
+    stream_pddl = read_pddl('../pddl/stream.pddl')
     if debug:
         return stream_pddl, DEBUG
+    key = get_stream_key(world, teleport_base=teleport_base, **kwargs)
+    if key not in world.stream_maps:
+        # Reused across restarts and replans so that the generators are only set up once
+        world.stream_maps.clear()
+        STREAM_CACHE.clear() # The outputs depend on the stream arguments
+        world.stream_maps[key] = create_stream_map(world, teleport_base=teleport_base, **kwargs)
+    return stream_pddl, dict(world.stream_maps[key])
+
+def create_stream_map(world, teleport_base=False, base_planner=BASE_PLANNER, **kwargs):
+    cached = STREAM_CACHE.wrap_gen_fn
     stream_map = {
         'test-door': from_test(get_door_test(world)),
         'test-gripper': from_test(get_gripper_open_test(world)),
@@ -79,12 +127,13 @@ def get_streams(world, debug=False, teleport_base=False, **kwargs):
         'sample-grasp': from_gen_fn(get_grasp_gen(world)),
         'sample-nearby-pose': from_gen_fn(get_nearby_stable_gen(world, **kwargs)),
 
-        'plan-pick': from_gen_fn(get_pick_gen_fn(world, **kwargs)),
-        'plan-pull': from_gen_fn(get_pull_gen_fn(world, **kwargs)),
-        'plan-press': from_gen_fn(get_press_gen_fn(world, **kwargs)),
-        'plan-pour': from_gen_fn(get_pour_gen_fn(world, **kwargs)),
+        'plan-pick': from_gen_fn(cached('plan-pick', get_pick_gen_fn(world, **kwargs))),
+        'plan-pull': from_gen_fn(cached('plan-pull', get_pull_gen_fn(world, **kwargs))),
+        'plan-press': from_gen_fn(cached('plan-press', get_press_gen_fn(world, **kwargs))),
+        'plan-pour': from_gen_fn(cached('plan-pour', get_pour_gen_fn(world, **kwargs))),
 
-        'plan-base-motion': from_fn(get_base_motion_fn(world, teleport_base=teleport_base, **kwargs)),
+        'plan-base-motion': from_fn(get_base_motion_fn(world, teleport_base=teleport_base,
+                                                       planner=base_planner, **kwargs)),
         'plan-arm-motion': from_fn(get_arm_motion_gen(world, **kwargs)),
         'plan-gripper-motion': from_fn(get_gripper_motion_gen(world, **kwargs)),
         'plan-calibrate-motion': from_fn(get_calibrate_gen(world, **kwargs)),
@@ -92,10 +141,10 @@ def get_streams(world, debug=False, teleport_base=False, **kwargs):
         'test-near-pose': from_test(get_test_near_pose(world, **kwargs)),
         'test-near-joint': from_test(get_test_near_joint(world, **kwargs)),
 
-        'fixed-plan-pick': from_gen_fn(get_fixed_pick_gen_fn(world, **kwargs)),
-        'fixed-plan-pull': from_gen_fn(get_fixed_pull_gen_fn(world, **kwargs)),
-        'fixed-plan-press': from_gen_fn(get_fixed_press_gen_fn(world, **kwargs)),
-        'fixed-plan-pour': from_gen_fn(get_fixed_pour_gen_fn(world, **kwargs)),
+        'fixed-plan-pick': from_gen_fn(cached('fixed-plan-pick', get_fixed_pick_gen_fn(world, **kwargs))),
+        'fixed-plan-pull': from_gen_fn(cached('fixed-plan-pull', get_fixed_pull_gen_fn(world, **kwargs))),
+        'fixed-plan-press': from_gen_fn(cached('fixed-plan-press', get_fixed_press_gen_fn(world, **kwargs))),
+        'fixed-plan-pour': from_gen_fn(cached('fixed-plan-pour', get_fixed_pour_gen_fn(world, **kwargs))),
 
         'compute-pose-kin': from_fn(get_compute_pose_kin(world)),
         # 'compute-angle-kin': from_fn(compute_angle_kin),
@@ -119,7 +168,7 @@ def get_streams(world, debug=False, teleport_base=False, **kwargs):
         #'MoveCost': move_cost_fn,
         # 'Distance': base_cost_fn,
     }
-    return stream_pddl, stream_map
+    return stream_map
 
 ################################################################################
 
@@ -133,8 +182,48 @@ def door_closed_formula(joint_name):
 def door_open_formula(joint_name):
     return door_status_formula(joint_name, OPEN)
 
-def get_goal(belief, init, base_threshold=(0.05, 0.05, math.radians(10)), arm_threshold=math.radians(10)):
-    # TODO: order goals for serialization
+def is_localized_on(belief, name, surface):
+    if name not in belief.pose_dists:
+        return False
+    pose_dist = belief.pose_dists[name]
+    return pose_dist.is_localized() and (set(pose_dist.surface_dist.support()) == {surface})
+
+def get_task_goals(belief):
+    # Triples of the goal type, literal, and whether the belief already achieves it
+    world = belief.world
+    task = world.task
+    door_test = get_door_test(world)
+    goals = []
+    if task.goal_hand_empty:
+        goals.append(('HandEmpty', ('HandEmpty',), belief.holding is None))
+    if task.goal_holding is not None:
+        goals.append(('Holding', ('Holding', task.goal_holding), belief.holding == task.goal_holding))
+    goals += [('On', ('On', name, surface), is_localized_on(belief, name, surface))
+              for name, surface in task.goal_on.items()] + \
+             [('Pressed', Not(('Pressed', name)), name not in belief.pressed) for name in KNOBS] + \
+             [('HasLiquid', ('HasLiquid', cup, liquid), (cup, liquid) in belief.liquid)
+              for cup, liquid in task.goal_liquid] + \
+             [('Cooked', ('Cooked', name), name in belief.cooked) for name in task.goal_cooked] + \
+             [('Localized', ('Localized', name), (name in belief.pose_dists) and belief.pose_dists[name].is_localized())
+              for name in task.goal_detected] + \
+             [('Closed', door_closed_formula(joint_name), door_test(joint_name, belief.door_confs[joint_name], CLOSED))
+              for joint_name in task.goal_closed] + \
+             [('Open', door_open_formula(joint_name), door_test(joint_name, belief.door_confs[joint_name], OPEN))
+              for joint_name in task.goal_open] + \
+             [('Goal', literal, False) for literal in task.goal]
+    return goals
+
+def get_serialized_goals(belief, min_goals=0):
+    # Achieved goals are kept while the first unachieved goal (in SERIAL_ORDER) is added
+    # Returns None once the prefix contains every goal
+    goals = sorted(get_task_goals(belief), key=lambda goal: (not goal[2], SERIAL_ORDER.index(goal[0])))
+    num_achieved = sum(achieved for _, _, achieved in goals)
+    num_goals = max(num_achieved + 1, min_goals)
+    if len(goals) <= num_goals:
+        return None
+    return [literal for _, literal, _ in goals[:num_goals]]
+
+def get_goal(belief, init, goals=None, base_threshold=(0.05, 0.05, math.radians(10)), arm_threshold=math.radians(10)):
     # TODO: make independent of belief and world
     world = belief.world  # One world per state
     task = world.task  # One task per world
@@ -143,18 +232,11 @@ def get_goal(belief, init, base_threshold=(0.05, 0.05, math.radians(10)), arm_th
 
     carry_aq = world.carry_conf
     goal_literals = [Not(('Unsafe',))]
-    if task.goal_hand_empty:
-        goal_literals.append(('HandEmpty',))
-    if task.goal_holding is not None:
-        goal_literals.append(('Holding', task.goal_holding))
-    goal_literals += [('On', name, surface) for name, surface in task.goal_on.items()] + \
-                     [Not(('Pressed', name)) for name in KNOBS] + \
-                     [('HasLiquid', cup, liquid) for cup, liquid in task.goal_liquid] + \
-                     [('Cooked', name) for name in task.goal_cooked] + \
-                     [('Localized', name) for name in task.goal_detected] + \
-                     [door_closed_formula(joint_name) for joint_name in task.goal_closed] + \
-                     [door_open_formula(joint_name) for joint_name in task.goal_open] + \
-                     list(task.goal)
+    if goals is not None:
+        # The remaining goals, including returning to the initial confs, are omitted
+        goal_literals.extend(goals)
+        return existential_quantification(goal_literals)
+    goal_literals.extend(literal for _, literal, _ in get_task_goals(belief))
 
     if not task.movable_base or task.return_init_bq:  # fixed_base?
         goal_bq = world.goal_bq if task.movable_base else init_bq
@@ -190,15 +272,18 @@ def get_goal(belief, init, base_threshold=(0.05, 0.05, math.radians(10)), arm_th
 
 ################################################################################
 
-def pdddlstream_from_problem(belief, additional_init=[], fixed_base=True, **kwargs):
+def pdddlstream_from_problem(belief, additional_init=[], fixed_base=True, goals=None, **kwargs):
     world = belief.world # One world per state
     task = world.task # One task per world
     print(task)
-    domain_pddl = read(get_file_path(__file__, '../pddl/domain.pddl'))
+    domain_pddl = read_pddl('../pddl/domain.pddl')
     # TODO: repackage stream outputs to avoid recomputation
 
     # Despite the base not moving, it could be re-estimated
     init_bq = belief.base_conf
+    world.current_bq = init_bq # Database base confs are proposed nearby first
+    STREAM_CACHE.set_scene(belief)
+    STREAM_CACHE.start_problem() # Once per problem rather than per restart, which reuses the problem
     init_aq = belief.arm_conf
     init_gq = belief.gripper_conf
 
@@ -447,7 +532,7 @@ def pdddlstream_from_problem(belief, additional_init=[], fixed_base=True, **kwar
     #bodies_from_type = get_bodies_from_type(problem)
     #bodies = bodies_from_type[get_parameter_name(ty)] if is_parameter(ty) else [ty]
 
-    goal_formula = get_goal(belief, init)
+    goal_formula = get_goal(belief, init, goals=goals)
     stream_pddl, stream_map = get_streams(world, teleport_base=task.teleport_base, **kwargs)
 
     print('Constants:', constant_map)
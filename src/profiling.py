@@ -0,0 +1,194 @@
+from __future__ import print_function
+
+import bisect
+import cProfile
+import os
+import time
+
+from collections import defaultdict
+from contextlib import contextmanager
+
+from pybullet_tools.utils import elapsed_time, ensure_dir
+from src.failures import FAILURES
+
+OFF = 'off'
+CPROFILE = 'cprofile'
+TIME = 'time' # Wall-clock only
+PROFILE_MODES = [OFF, CPROFILE, TIME]
+
+OBSERVE = 'observe'
+UPDATE = 'update'
+PLAN = 'plan'
+EXECUTE = 'execute'
+STREAM = 'stream'
+PROFILE_PHASES = [OBSERVE, UPDATE, PLAN, EXECUTE, STREAM]
+
+TIME_BINS = [1e-3, 1e-2, 1e-1, 1e0, 1e1] # Upper edges (in seconds) of the stream runtime histogram
+KEY_BY_INPUTS = False # Additionally splits the stream statistics by their object/surface inputs
+
+# Absolute because run_experiment.py removes each trial's working directory
+PROFILE_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'profiles/')
+
+def is_iterator(outputs):
+    return hasattr(outputs, '__next__') or hasattr(outputs, 'next')
+
+class Profiler(object):
+    # Only one cProfile.Profile can be enabled at a time, so nested phases (e.g. streams while planning)
+    # are only timed unless the outer phase is not profiled
+    def __init__(self, mode=OFF, phases=PROFILE_PHASES, directory=PROFILE_DIRECTORY, name='profile'):
+        assert mode in PROFILE_MODES
+        self.mode = mode
+        self.phases = set(phases)
+        self.directory = directory
+        self.name = name
+        self.iteration = 0
+        self.profiles = {} # phase -> cProfile.Profile for the current iteration
+        self.active = None
+        self.times = defaultdict(float)
+        self.counts = defaultdict(int)
+    def is_enabled(self, phase):
+        return (self.mode != OFF) and (phase in self.phases)
+    @contextmanager
+    def profile(self, phase):
+        if not self.is_enabled(phase):
+            yield
+            return
+        profile = None
+        if (self.mode == CPROFILE) and (self.active is None):
+            profile = self.profiles.setdefault(phase, cProfile.Profile())
+            self.active = phase
+            profile.enable()
+        start_time = time.time()
+        try:
+            yield
+        finally:
+            self.times[phase] += elapsed_time(start_time)
+            self.counts[phase] += 1
+            if profile is not None:
+                profile.disable()
+                self.active = None
+    def wrap_iterator(self, iterator, phase):
+        while True:
+            with self.profile(phase):
+                try:
+                    output = next(iterator)
+                except StopIteration:
+                    return
+            yield output
+    def wrap_fn(self, fn, phase=STREAM):
+        # Generator streams do their work lazily, so each next() is profiled as well
+        def wrapped_fn(*args, **kwargs):
+            with self.profile(phase):
+                outputs = fn(*args, **kwargs)
+            if not is_iterator(outputs):
+                return outputs
+            return self.wrap_iterator(outputs, phase)
+        return wrapped_fn
+    def wrap_stream_map(self, stream_map):
+        if not self.is_enabled(STREAM) or not isinstance(stream_map, dict):
+            return stream_map
+        return {name: self.wrap_fn(fn) if callable(fn) else fn
+                for name, fn in stream_map.items()}
+    def dump(self):
+        # Writes one .pstats file per phase profiled during the current iteration
+        paths = []
+        for phase, profile in sorted(self.profiles.items()):
+            path = os.path.join(self.directory, '{}_i={}_{}.pstats'.format(self.name, self.iteration, phase))
+            ensure_dir(path)
+            profile.dump_stats(path)
+            paths.append(path)
+        self.profiles = {}
+        self.iteration += 1
+        return paths
+    def get_statistics(self):
+        return {phase: {'count': self.counts[phase], 'time': self.times[phase]}
+                for phase in sorted(self.times)}
+    def merge(self, statistics):
+        # Adds the statistics of another process (e.g. a portfolio worker)
+        for phase, phase_statistics in statistics.items():
+            self.counts[phase] += phase_statistics['count']
+            self.times[phase] += phase_statistics['time']
+    def reset(self):
+        self.times.clear()
+        self.counts.clear()
+    def __repr__(self):
+        return '{}({}, {})'.format(self.__class__.__name__, self.mode, ', '.join(
+            '{}={:.3f}'.format(phase, self.times[phase]) for phase in sorted(self.times)))
+
+################################################################################
+
+class StreamStatistics(object):
+    # Each evaluation of a pddlstream stream function returns a list of outputs (empty when it fails)
+    def __init__(self, by_inputs=KEY_BY_INPUTS, bins=TIME_BINS):
+        self.by_inputs = by_inputs
+        self.bins = bins
+        self.statistics = {}
+    def get_key(self, name, args):
+        if not self.by_inputs:
+            return name
+        return '{}({})'.format(name, ', '.join(arg for arg in args if isinstance(arg, str)))
+    def record(self, key, runtime, outputs):
+        statistics = self.statistics.setdefault(key, {
+            'calls': 0, 'outputs': 0, 'nones': 0, 'time': 0.,
+            'histogram': [0]*(len(self.bins) + 1),
+        })
+        num_outputs = len(outputs) if isinstance(outputs, list) else int(outputs is not None)
+        statistics['calls'] += 1
+        statistics['outputs'] += num_outputs
+        statistics['nones'] += (num_outputs == 0)
+        statistics['time'] += runtime
+        statistics['histogram'][bisect.bisect_left(self.bins, runtime)] += 1
+    def wrap_iterator(self, key, iterator):
+        while True:
+            start_time = time.time()
+            previous_stream, FAILURES.stream = FAILURES.stream, key
+            try:
+                outputs = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                FAILURES.stream = previous_stream
+            self.record(key, elapsed_time(start_time), outputs)
+            yield outputs
+    def wrap_fn(self, name, fn):
+        def wrapped_fn(*args, **kwargs):
+            key = self.get_key(name, args)
+            start_time = time.time()
+            previous_stream, FAILURES.stream = FAILURES.stream, key
+            try:
+                outputs = fn(*args, **kwargs)
+            finally:
+                FAILURES.stream = previous_stream
+            if is_iterator(outputs):
+                return self.wrap_iterator(key, outputs)
+            self.record(key, elapsed_time(start_time), outputs)
+            return outputs
+        return wrapped_fn
+    def wrap_stream_map(self, stream_map):
+        if not isinstance(stream_map, dict):
+            return stream_map
+        return {name: self.wrap_fn(name, fn) if callable(fn) else fn
+                for name, fn in stream_map.items()}
+    def get_statistics(self):
+        return {key: dict(statistics) for key, statistics in self.statistics.items()}
+    def merge(self, statistics):
+        # Adds the statistics of another process (e.g. a portfolio worker)
+        for key, other in statistics.items():
+            if key not in self.statistics:
+                self.statistics[key] = {name: list(value) if isinstance(value, list) else value
+                                        for name, value in other.items()}
+                continue
+            current = self.statistics[key]
+            for name in ['calls', 'outputs', 'nones', 'time']:
+                current[name] += other[name]
+            current['histogram'] = [count1 + count2 for count1, count2
+                                    in zip(current['histogram'], other['histogram'])]
+    def reset(self):
+        self.statistics = {}
+    def dump(self, num=10):
+        print('{:<40} {:>7} {:>7} {:>7} {:>9}'.format('Stream', 'Calls', 'Outputs', 'Nones', 'Time'))
+        for key, statistics in sorted(self.statistics.items(), key=lambda pair: -pair[1]['time'])[:num]:
+            print('{:<40} {:>7} {:>7} {:>7} {:>9.3f}'.format(
+                key, statistics['calls'], statistics['outputs'], statistics['nones'], statistics['time']))
+    def __repr__(self):
+        return '{}({})'.format(self.__class__.__name__, len(self.statistics))
@@ -1,13 +1,15 @@
+import numpy as np
+
 from itertools import count
 
 from pddlstream.algorithms.constraints import WILD, ORDER_PREDICATE
 from pddlstream.language.constants import Action, EQ, get_prefix, get_args, is_cost, is_parameter
 from pddlstream.language.object import OPT_PREFIX
-from pddlstream.algorithms.downward import get_fluents
-from pddlstream.algorithms.algorithm import parse_domain
 from pddlstream.utils import INF, implies, hash_or_id
+from pybullet_tools.pr2_primitives import Conf
+from pybullet_tools.utils import get_difference_fn
 #from src.utils import FConf
-from src.problem import ACTION_COSTS
+from src.problem import ACTION_COSTS, get_domain_fluents
 
 
 OBSERVATION_ACTIONS = {'detect'}
@@ -25,6 +27,14 @@ REUSE_ARGUMENTS = {
     # However, it was next constrained to move the base rather than the arm
 }
 
+# Relative pose parameters of ?o1 that must be the current pose of ?o1
+POSE_PARAMETERS = {
+    'pick': 3, # ?rp
+    'detect': 2, # ?rp1
+}
+MONITOR_CONF_TOLERANCE = 1e-2 # Radians or meters
+MONITOR_POSE_TOLERANCE = 1e-2
+
 # TODO: could keep around previous base plans as long as we don't reuse them
 # Don't need to replan safe plans form teh same location
 # My worry is that the ground plane will shift
@@ -105,8 +115,7 @@ def reuse_facts(problem, certificate, skeleton):
     # The reuse relpose omission is due to the fact that the initial pose was selected
     # (which is populated in the initial state)
     order_predicate = ORDER_PREDICATE.format('')
-    domain = parse_domain(problem.domain_pddl)
-    fluents = get_fluents(domain)
+    fluents = get_domain_fluents(problem.domain_pddl)
     for fact in certificate.preimage_facts:
         predicate = get_prefix(fact)
         if (predicate in {order_predicate, EQ}) or (predicate in fluents):
@@ -131,3 +140,75 @@ def compute_plan_cost(plan):
 def get_plan_postfix(plan, plan_prefix):
     return [action for action in plan[len(plan_prefix):]
             if isinstance(action, Action)]
+
+################################################################################
+
+def get_localized_pose(belief, name):
+    if (name not in belief.pose_dists) or not belief.pose_dists[name].is_localized():
+        return None
+    [pose] = belief.pose_dists[name].dist.support()
+    return pose
+
+def are_poses_close(belief, name, pose, tol=MONITOR_POSE_TOLERANCE):
+    current_pose = get_localized_pose(belief, name)
+    if current_pose is None:
+        return False
+    pose_dist = belief.pose_dists[name]
+    return (pose.support == current_pose.support) and np.allclose(
+        pose_dist.pose2d_from_pose(pose), pose_dist.pose2d_from_pose(current_pose), rtol=0., atol=tol)
+
+def are_values_close(conf1, conf2, tol=MONITOR_CONF_TOLERANCE):
+    difference_fn = get_difference_fn(conf1.body, conf1.joints)
+    return np.allclose(difference_fn(conf1.values, conf2.values), np.zeros(len(conf1.joints)), rtol=0., atol=tol)
+
+def get_expected_state(belief):
+    # The state that the plan postfix assumes once the prefix has been executed
+    return {
+        'holding': belief.holding,
+        'door_confs': dict(belief.door_confs),
+        'poses': {name: get_localized_pose(belief, name) for name in belief.pose_dists},
+    }
+
+def is_postfix_valid(belief, expected_state, plan_postfix,
+                     conf_tolerance=MONITOR_CONF_TOLERANCE, pose_tolerance=MONITOR_POSE_TOLERANCE):
+    # Tests whether the updated belief still satisfies the preconditions of the bound plan postfix
+    if not plan_postfix:
+        return False # Only replanning checks whether the goal is achieved
+    if any(is_optimistic(arg) for _, args in plan_postfix for arg in args):
+        return False
+    if (belief.holding != expected_state['holding']) or (set(belief.pose_dists) != set(expected_state['poses'])):
+        return False
+    for name, conf in expected_state['door_confs'].items():
+        if not are_values_close(conf, belief.door_confs[name], tol=conf_tolerance):
+            return False
+    for name, pose in expected_state['poses'].items():
+        if (pose is not None) and not are_poses_close(belief, name, pose, tol=pose_tolerance):
+            return False
+
+    # The first value of each conf and pose in the postfix is a precondition
+    current_confs = {(conf.body, tuple(conf.joints)): conf for conf in
+                     [belief.base_conf, belief.arm_conf, belief.gripper_conf] + list(belief.door_confs.values())
+                     if conf is not None}
+    checked_confs = set()
+    checked_objects = set()
+    checked_holding = False
+    for name, args in plan_postfix:
+        if (name in ['pick', 'place']) and not checked_holding:
+            checked_holding = True
+            if belief.holding != (args[0] if name == 'place' else None):
+                return False
+        if (name in ['pick', 'place', 'detect']) and (args[0] not in checked_objects):
+            checked_objects.add(args[0])
+            if (name in POSE_PARAMETERS) and not are_poses_close(
+                    belief, args[0], args[POSE_PARAMETERS[name]], tol=pose_tolerance):
+                return False
+        for arg in args:
+            if not isinstance(arg, Conf):
+                continue
+            key = (arg.body, tuple(arg.joints))
+            if key in checked_confs:
+                continue
+            checked_confs.add(key)
+            if (key not in current_confs) or not are_values_close(arg, current_confs[key], tol=conf_tolerance):
+                return False
+    return True
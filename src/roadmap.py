@@ -0,0 +1,257 @@
+from __future__ import print_function
+
+import heapq
+import math
+import os
+import time
+import zlib
+
+import numpy as np
+
+from collections import OrderedDict
+from scipy.spatial import cKDTree
+
+from pybullet_tools.utils import read_json, get_extend_fn, get_custom_limits, pairwise_collision, \
+    set_joint_positions, circular_difference, BodySaver, elapsed_time
+from src.cache import get_signature
+from src.database import DATABASE_DIRECTORY, ANGLE_WEIGHT
+from src.utils import update_json
+
+# Base roadmaps are built once per robot and kitchen and stored next to the databases
+ROADMAP_FILENAME = '{}-roadmap.json'
+ROADMAP_VERTICES = 500
+ROADMAP_NEIGHBORS = 10
+ROADMAP_ATTEMPTS = 10 # Samples per vertex
+CONNECT_NEIGHBORS = 10 # Roadmap vertices that the start and goal confs are connected to
+MAX_LAZY_ITERATIONS = 50 # Graph searches per query
+MAX_CONTEXTS = 32 # Obstacle contexts (door angles and arm conf) whose edge checks are cached
+BASE_RESOLUTIONS = np.array([0.05, 0.05, math.radians(10)])
+MIN_TRANSLATION = 1e-3
+
+ROADMAPS = {} # key -> BaseRoadmap
+
+def get_roadmap_path(robot_name):
+    return os.path.abspath(os.path.join(DATABASE_DIRECTORY, ROADMAP_FILENAME.format(robot_name)))
+
+def get_roadmap_seed(key):
+    # hash() of a str is salted per process in Python 3
+    return zlib.crc32(key.encode('utf-8')) & 0xffffffff
+
+def get_roadmap_key(world, num_vertices=ROADMAP_VERTICES, num_neighbors=ROADMAP_NEIGHBORS):
+    lower_limits, upper_limits = get_custom_limits(world.robot, world.base_joints[:2], world.custom_limits)
+    limits = [round(value, 3) for value in list(lower_limits) + list(upper_limits)]
+    return 'roadmap|{}|{}|{}|{}'.format(','.join(sorted(world.environment_bodies)), limits,
+                                        num_vertices, num_neighbors)
+
+def embed_confs(confs, angle_weight=ANGLE_WEIGHT):
+    confs = np.reshape(np.array(confs, dtype=np.float64), (-1, 3))
+    return np.hstack([confs[:, :2], angle_weight*np.cos(confs[:, 2:]), angle_weight*np.sin(confs[:, 2:])])
+
+def get_edge_waypoints(q1, q2):
+    # Turns in place, drives straight (forward or in reverse), and turns in place
+    (x1, y1, theta1), (x2, y2, theta2) = q1, q2
+    if np.hypot(x2 - x1, y2 - y1) < MIN_TRANSLATION:
+        return [tuple(q1), tuple(q2)]
+    heading = math.atan2(y2 - y1, x2 - x1)
+    heading = min([heading, heading + np.pi], key=lambda h: abs(circular_difference(h, theta1)) +
+                                                            abs(circular_difference(theta2, h)))
+    heading = theta1 + circular_difference(heading, theta1)
+    return [tuple(q1), (x1, y1, heading), (x2, y2, heading), tuple(q2)]
+
+def get_edge_cost(q1, q2, angle_weight=ANGLE_WEIGHT):
+    waypoints = get_edge_waypoints(q1, q2)
+    return sum(np.hypot(x2 - x1, y2 - y1) + angle_weight*abs(circular_difference(theta2, theta1))
+               for (x1, y1, theta1), (x2, y2, theta2) in zip(waypoints, waypoints[1:]))
+
+def is_path_free(world, path, obstacles, attachments=[], attachment_obstacles=set()):
+    for conf in path:
+        set_joint_positions(world.robot, world.base_joints, conf)
+        if any(pairwise_collision(world.robot, obst) for obst in obstacles):
+            return False
+        for attachment in attachments:
+            attachment.assign()
+            if any(pairwise_collision(attachment.child, obst) for obst in attachment_obstacles):
+                return False
+    return True
+
+################################################################################
+
+class BaseRoadmap(object):
+    # Lazy roadmap: edges are only collision checked once they are on the shortest path
+    # Checks against the kitchen are cached per obstacle context while movable obstacles are checked per query
+    def __init__(self, world, vertices, edges, resolutions=BASE_RESOLUTIONS):
+        self.world = world
+        self.vertices = [tuple(vertex) for vertex in vertices]
+        self.edges = sorted({(min(i, j), max(i, j)) for i, j in edges})
+        self.neighbors = {i: set() for i in range(len(self.vertices))}
+        for i, j in self.edges:
+            self.neighbors[i].add(j)
+            self.neighbors[j].add(i)
+        self.costs = {(i, j): get_edge_cost(self.vertices[i], self.vertices[j]) for i, j in self.edges}
+        self.tree = cKDTree(embed_confs(self.vertices)) if self.vertices else None
+        self.extend_fn = get_extend_fn(world.robot, world.base_joints, resolutions=resolutions)
+        self.contexts = OrderedDict() # context -> {edge: valid}
+        self.queries = 0
+        self.successes = 0
+        self.checks = 0
+        self.hits = 0
+    def get_nearby(self, conf, k=CONNECT_NEIGHBORS):
+        if self.tree is None:
+            return []
+        k = min(k, len(self.vertices))
+        _, indices = self.tree.query(embed_confs([conf])[0], k=k)
+        return [int(index) for index in np.atleast_1d(indices)]
+    def get_path(self, q1, q2):
+        path = [tuple(q1)]
+        waypoints = get_edge_waypoints(q1, q2)
+        for qa, qb in zip(waypoints, waypoints[1:]):
+            path.extend(map(tuple, self.extend_fn(qa, qb)))
+        return path
+    def get_context(self, context):
+        edge_status = self.contexts.pop(context, {})
+        self.contexts[context] = edge_status # Most recently used
+        while MAX_CONTEXTS < len(self.contexts):
+            self.contexts.popitem(last=False)
+        return edge_status
+    def search(self, confs, neighbors, invalid):
+        start, goal = len(confs) - 2, len(confs) - 1
+        costs = {start: 0.}
+        parents = {start: None}
+        queue = [(0., start)]
+        while queue:
+            cost, index = heapq.heappop(queue)
+            if costs[index] < cost:
+                continue
+            if index == goal:
+                path = [goal]
+                while parents[path[-1]] is not None:
+                    path.append(parents[path[-1]])
+                return path[::-1]
+            for neighbor in neighbors(index):
+                edge = (min(index, neighbor), max(index, neighbor))
+                if edge in invalid:
+                    continue
+                edge_cost = self.costs[edge] if edge in self.costs else get_edge_cost(confs[index], confs[neighbor])
+                new_cost = cost + edge_cost
+                if new_cost < costs.get(neighbor, np.inf):
+                    costs[neighbor] = new_cost
+                    parents[neighbor] = index
+                    heapq.heappush(queue, (new_cost, neighbor))
+        return None
+    def plan(self, q1, q2, context_obstacles, obstacles=set(), attachments=[], context=None):
+        # context_obstacles are fixed for a context (e.g. the kitchen and its doors) while obstacles vary per query
+        self.queries += 1
+        edge_status = self.get_context(context)
+        all_obstacles = set(context_obstacles) | set(obstacles)
+        confs = self.vertices + [tuple(q1), tuple(q2)]
+        start, goal = len(confs) - 2, len(confs) - 1
+        connections = {start: set(self.get_nearby(q1)) | {goal},
+                       goal: set(self.get_nearby(q2)) | {start}}
+        def neighbors(index):
+            if index in connections:
+                return connections[index]
+            return list(self.neighbors[index]) + [other for other in connections if index in connections[other]]
+
+        invalid = set()
+        paths = {}
+        with BodySaver(self.world.robot):
+            for _ in range(MAX_LAZY_ITERATIONS):
+                indices = self.search(confs, neighbors, invalid)
+                if indices is None:
+                    return None
+                for index1, index2 in zip(indices, indices[1:]):
+                    edge = (min(index1, index2), max(index1, index2))
+                    if edge not in paths:
+                        paths[edge] = self.get_path(confs[edge[0]], confs[edge[1]])
+                    path = paths[edge]
+                    if edge in self.costs:
+                        if edge not in edge_status:
+                            self.checks += 1
+                            edge_status[edge] = is_path_free(self.world, path, context_obstacles)
+                        else:
+                            self.hits += 1
+                        valid = edge_status[edge] and is_path_free(self.world, path, obstacles, attachments=attachments,
+                                                                   attachment_obstacles=all_obstacles)
+                    else:
+                        valid = is_path_free(self.world, path, all_obstacles, attachments=attachments,
+                                             attachment_obstacles=all_obstacles)
+                    if not valid:
+                        invalid.add(edge)
+                        break
+                else:
+                    self.successes += 1
+                    path = [confs[indices[0]]]
+                    for index1, index2 in zip(indices, indices[1:]):
+                        edge_path = paths[(min(index1, index2), max(index1, index2))]
+                        path.extend(edge_path[1:] if index1 < index2 else edge_path[::-1][1:])
+                    return path
+        return None
+    def get_statistics(self):
+        return {
+            'vertices': len(self.vertices),
+            'edges': len(self.edges),
+            'contexts': len(self.contexts),
+            'queries': self.queries,
+            'successes': self.successes,
+            'checks': self.checks,
+            'hits': self.hits,
+        }
+    def __repr__(self):
+        return '{}({})'.format(self.__class__.__name__, self.get_statistics())
+
+################################################################################
+
+def build_roadmap(world, num_vertices=ROADMAP_VERTICES, num_neighbors=ROADMAP_NEIGHBORS,
+                  max_attempts=ROADMAP_ATTEMPTS, seed=None):
+    # Vertices are collision-free with respect to the kitchen (without its doors) at the carry conf
+    # A separate random state keeps the roadmap reproducible without consuming the global random state
+    random_state = np.random.RandomState(seed)
+    lower_limits, upper_limits = get_custom_limits(world.robot, world.base_joints[:2], world.custom_limits)
+    obstacles = world.static_obstacles
+    vertices = []
+    with BodySaver(world.robot):
+        world.carry_conf.assign()
+        for _ in range(max_attempts*num_vertices):
+            if num_vertices <= len(vertices):
+                break
+            x, y = random_state.uniform(lower_limits, upper_limits)
+            conf = (x, y, random_state.uniform(-np.pi, np.pi))
+            if is_path_free(world, [conf], obstacles):
+                vertices.append(conf)
+    edges = set()
+    if vertices:
+        tree = cKDTree(embed_confs(vertices))
+        k = min(num_neighbors + 1, len(vertices))
+        for i, vertex in enumerate(vertices):
+            _, indices = tree.query(embed_confs([vertex])[0], k=k)
+            edges.update((min(i, j), max(i, j)) for j in np.atleast_1d(indices) if i != j)
+    return vertices, sorted(edges)
+
+def load_roadmap(world, **kwargs):
+    key = get_roadmap_key(world, **kwargs)
+    if key in ROADMAPS:
+        return ROADMAPS[key]
+    roadmap_path = get_roadmap_path(world.robot_name)
+    roadmaps = read_json(roadmap_path) if os.path.exists(roadmap_path) else {}
+    if key not in roadmaps:
+        start_time = time.time()
+        vertices, edges = build_roadmap(world, seed=get_roadmap_seed(key), **kwargs)
+        print('Built a base roadmap with {} vertices and {} edges in {:.3f} seconds'.format(
+            len(vertices), len(edges), elapsed_time(start_time)))
+        roadmap = {
+            'vertices': [list(map(float, vertex)) for vertex in vertices],
+            'edges': [[int(i), int(j)] for i, j in edges],
+        }
+        def update_fn(data):
+            # Keeps the roadmaps saved by other processes, including one for the same key
+            data.setdefault(key, roadmap)
+            return data
+        roadmaps = update_json(roadmap_path, update_fn)
+    ROADMAPS[key] = BaseRoadmap(world, roadmaps[key]['vertices'], roadmaps[key]['edges'])
+    return ROADMAPS[key]
+
+def get_context(world, fluents, arm_conf):
+    # Base motions are checked against the kitchen at these door angles and this arm conf
+    angles = sorted((fluent[1], get_signature(fluent[2])) for fluent in fluents
+                    if fluent[0] == 'AtAngle'.lower())
+    return (tuple(angles), get_signature(arm_conf))
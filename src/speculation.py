@@ -0,0 +1,103 @@
+from __future__ import print_function
+
+import time
+
+import numpy as np
+
+from examples.discrete_belief.dist import DeltaDist
+from pybullet_tools.utils import WorldSaver, elapsed_time, INF
+from src.belief import transition_belief_update
+from src.inference import PoseDist
+from src.portfolio import Worker, FAILED_SOLUTION, get_shared_objects
+
+CONF_TOLERANCE = 1e-2 # Radians or meters
+POSE_TOLERANCE = 1e-2
+PROB_TOLERANCE = 1e-2
+PREDICTION_TIMEOUT = 5 # Seconds to wait for the worker to send the predicted belief
+
+def predict_belief(belief, plan_prefix):
+    # Most likely outcome of the prefix: each action succeeds and each detection confirms the planned pose
+    if not transition_belief_update(belief, plan_prefix):
+        return False
+    for action, params in plan_prefix:
+        if action == 'move_base':
+            bq1, bq2, bt = params
+            belief.base_conf = bq2 # Otherwise, only updated by the observation
+        elif action == 'detect':
+            o1, wp1, rp1, obs, wp2, rp2 = params[:6]
+            belief.pose_dists[o1] = PoseDist(belief.world, o1, DeltaDist(rp2))
+    return True
+
+def summarize_belief(belief):
+    confs = [belief.base_conf, belief.arm_conf, belief.gripper_conf] + \
+            [belief.door_confs[name] for name in sorted(belief.door_confs)]
+    poses = {}
+    with WorldSaver():
+        for name, pose_dist in belief.pose_dists.items():
+            poses[name] = sorted((pose.support, tuple(pose_dist.pose2d_from_pose(pose)), pose_dist.discrete_prob(pose))
+                                 for pose in pose_dist.dist.support())
+    return {
+        'discrete': (belief.holding, sorted(belief.pressed), sorted(belief.cooked),
+                     sorted(belief.liquid), sorted(belief.door_confs), sorted(poses)),
+        'confs': [() if conf is None else tuple(conf.values) for conf in confs],
+        'poses': poses,
+    }
+
+def beliefs_match(summary1, summary2, conf_tolerance=CONF_TOLERANCE,
+                  pose_tolerance=POSE_TOLERANCE, prob_tolerance=PROB_TOLERANCE):
+    if summary1['discrete'] != summary2['discrete']:
+        return False
+    for values1, values2 in zip(summary1['confs'], summary2['confs']):
+        if (len(values1) != len(values2)) or not np.allclose(values1, values2, rtol=0., atol=conf_tolerance):
+            return False
+    for name, poses1 in summary1['poses'].items():
+        poses2 = summary2['poses'][name]
+        if len(poses1) != len(poses2):
+            return False
+        for (surface1, pose2d1, prob1), (surface2, pose2d2, prob2) in zip(poses1, poses2):
+            if (surface1 != surface2) or (prob_tolerance < abs(prob1 - prob2)) or \
+                    not np.allclose(pose2d1, pose2d2, rtol=0., atol=pose_tolerance):
+                return False
+    return True
+
+################################################################################
+
+class Speculation(object):
+    # Plans the next iteration from the predicted belief in a forked worker while the prefix executes
+    def __init__(self, belief, problem, plan, plan_prefix):
+        self.worker = Worker('speculation', get_shared_objects(belief, problem, plan=plan))
+        self.belief = belief
+        self.plan_prefix = plan_prefix
+    def start(self, plan_fn):
+        # plan_fn(predicted_belief) -> (plan, cost, certificate) is evaluated by the worker
+        def fn():
+            belief = self.belief # The worker's copy
+            success = predict_belief(belief, self.plan_prefix)
+            self.worker.send(summarize_belief(belief))
+            if not success:
+                return FAILED_SOLUTION
+            return plan_fn(belief)
+        self.worker.start(fn)
+        return self
+    def resolve(self, belief, max_time=INF):
+        # Only waits for the speculative plan when the observed belief matches the prediction
+        start_time = time.time()
+        try:
+            observed_summary = summarize_belief(belief)
+            # The prediction is sent before planning, so a missing prediction is not waited on for long
+            predicted_summary = self.worker.wait(timeout=min(max_time, PREDICTION_TIMEOUT))
+            if (predicted_summary is None) or not beliefs_match(predicted_summary, observed_summary):
+                self.cancel() # Kills the worker right away rather than letting it plan for the wrong belief
+                print('Speculation | Belief differs from the prediction')
+                return FAILED_SOLUTION
+            solution = self.worker.wait(timeout=max_time - elapsed_time(start_time)) or FAILED_SOLUTION
+            plan, cost, _ = solution
+            print('Speculation | Solved: {} | Cost: {:.3f} | Wait: {:.3f} | Total: {:.3f}'.format(
+                plan is not None, cost, elapsed_time(start_time), elapsed_time(self.worker.start_time)))
+            return solution
+        finally:
+            self.cancel()
+    def cancel(self):
+        self.worker.kill()
+    def __repr__(self):
+        return '{}({})'.format(self.__class__.__name__, self.plan_prefix)
@@ -16,7 +16,8 @@ from pybullet_tools.utils import pairwise_collision, multiply, invert, get_joint
 from pddlstream.algorithms.downward import MAX_FD_COST #, get_cost_scale
 
 from src.command import Sequence, State, Detect, DoorTrajectory
-from src.database import load_placements, get_surface_reference_pose, load_pull_base_poses, load_forward_placements, load_inverse_placements
+from src.database import load_placements, get_surface_reference_pose, load_pull_base_poses, load_forward_placements, \
+    load_inverse_placements, load_forward_polygon, load_inverse_polygon, load_joint_polygon
 from src.utils import get_grasps, iterate_approach_path, ALL_SURFACES, \
     get_descendant_obstacles, surface_from_name, RelPose, compute_surface_aabb, create_relative_pose, Z_EPSILON, \
     get_surface_obstacles, test_supported, \
@@ -24,6 +25,7 @@ from src.utils import get_grasps, iterate_approach_path, ALL_SURFACES, \
     TOP_GRASP, KNOBS, APPROACH_DISTANCE, FINGER_EXTENT, set_tool_pose, translate_linearly
 from src.visualization import GROW_INVERSE_BASE, GROW_FORWARD_RADIUS
 from src.inference import SurfaceDist
+from src.failures import FAILURES, KINEMATIC, COLLISION, PROXIMITY, PATH, LIMITS, IR_EXHAUSTED
 from examples.discrete_belief.run import revisit_mdp_cost, clip_cost, DDist #, MAX_COST
 
 COST_SCALE = 1 # costs will always be greater than one
@@ -37,7 +39,6 @@ BASE_CONSTANT = 1.0 # 1 | 10
 BASE_VELOCITY = 0.25
 SELF_COLLISIONS = True
 
-PRINT_FAILURES = True
 MOVE_ARM = True
 ARM_RESOLUTION = 0.05
 GRIPPER_RESOLUTION = 0.01
@@ -299,7 +300,7 @@ def update_belief_fn(world, **kwargs):
 ################################################################################
 
 def get_test_near_pose(world, grow_entity=GROW_FORWARD_RADIUS, collisions=False, teleport=False, **kwargs):
-    base_from_objects = grow_polygon(map(point_from_pose, load_forward_placements(world, **kwargs)), radius=grow_entity)
+    base_from_objects = load_forward_polygon(world, radius=grow_entity, **kwargs)
     vertices_from_surface = {}
     # TODO: alternatively, distance to hull
 
@@ -307,8 +308,8 @@ def get_test_near_pose(world, grow_entity=GROW_FORWARD_RADIUS, collisions=False,
         if object_name in ALL_SURFACES:
             surface_name = object_name
             if surface_name not in vertices_from_surface:
-                vertices_from_surface[surface_name] = grow_polygon(
-                    map(point_from_pose, load_inverse_placements(world, surface_name)), radius=GROW_INVERSE_BASE)
+                vertices_from_surface[surface_name] = load_inverse_polygon(
+                    world, surface_name, radius=GROW_INVERSE_BASE)
             if not vertices_from_surface[surface_name]:
                 return False
             base_conf.assign()
@@ -323,7 +324,7 @@ def get_test_near_pose(world, grow_entity=GROW_FORWARD_RADIUS, collisions=False,
             #    points = [Point(x, y, 0) for x, y, in vertices_from_surface[surface_name]]
             #    add_segments(points, closed=True)
             #    wait_for_user()
-            return is_point_in_polygon(point_from_pose(surface_from_base), vertices_from_surface[surface_name])
+            return point_from_pose(surface_from_base) in vertices_from_surface[surface_name]
         else:
             if not base_from_objects:
                 return False
@@ -332,7 +333,7 @@ def get_test_near_pose(world, grow_entity=GROW_FORWARD_RADIUS, collisions=False,
             world_from_base = get_link_pose(world.robot, world.base_link)
             world_from_object = pose.get_world_from_body()
             base_from_object = multiply(invert(world_from_base), world_from_object)
-            return is_point_in_polygon(point_from_pose(base_from_object), base_from_objects)
+            return point_from_pose(base_from_object) in base_from_objects
     return test
 
 def get_test_near_joint(world, **kwargs):
@@ -342,15 +343,14 @@ def get_test_near_joint(world, **kwargs):
         if not DOOR_PROXIMITY:
             return True
         if joint_name not in vertices_from_joint:
-            base_confs = list(load_pull_base_poses(world, joint_name))
-            vertices_from_joint[joint_name] = grow_polygon(base_confs, radius=GROW_INVERSE_BASE)
+            vertices_from_joint[joint_name] = load_joint_polygon(world, joint_name, radius=GROW_INVERSE_BASE)
         if not vertices_from_joint[joint_name]:
             return False
         # TODO: can't open hitman_drawer_top_joint any more
         # Likely due to conservative carter geometry
         base_conf.assign()
         base_point = point_from_pose(get_link_pose(world.robot, world.base_link))
-        return is_point_in_polygon(base_point[:2], vertices_from_joint[joint_name])
+        return base_point[:2] in vertices_from_joint[joint_name]
     return test
 
 ################################################################################
@@ -499,10 +499,12 @@ def inverse_reachability(world, base_generator, obstacles=set(),
         for base_conf in islice(base_generator, max_attempts):
             attempt += 1
             if not all_between(lower_limits, base_conf, upper_limits):
+                FAILURES.count('base', LIMITS)
                 continue
             bq = FConf(world.robot, world.base_joints, base_conf)
             #wait_for_user()
             if not test_base_conf(world, bq, obstacles, min_distance=min_distance):
+                FAILURES.count('base', COLLISION)
                 continue
             if world.is_real():
                 # TODO: could also rotate in place
@@ -510,14 +512,15 @@ def inverse_reachability(world, base_generator, obstacles=set(),
                 nearby_values = translate_linearly(world, distance=-REVERSE_DISTANCE)
                 bq.nearby_bq = FConf(world.robot, world.base_joints, nearby_values)
                 if not test_base_conf(world, bq.nearby_bq, obstacles, min_distance=min_nearby_distance):
+                    FAILURES.count('nearby base', COLLISION)
                     continue
-            #if PRINT_FAILURES: print('Success after {} IR attempts:'.format(attempt))
+            #print('Success after {} IR attempts:'.format(attempt))
             bq.assign()
             #wait_for_user()
             yield bq
             break
         else:
-            if PRINT_FAILURES: print('Failed after {} IR attempts:'.format(attempt))
+            FAILURES.fail('IR', IR_EXHAUSTED, attempts=attempt)
             if attempt < max_attempts - 1:
                 return
             yield None
@@ -537,20 +540,20 @@ def plan_approach(world, approach_pose, attachments=[], obstacles=set(),
     full_approach_conf = world.solve_inverse_kinematics(
         approach_pose, nearby_tolerance=NEARBY_APPROACH)
     if full_approach_conf is None: # TODO: | {obj}
-        if PRINT_FAILURES: print('Pregrasp kinematic failure')
+        FAILURES.fail('pregrasp', KINEMATIC)
         return None
     moving_links = get_moving_links(world.robot, world.arm_joints)
     robot_obstacle = (world.robot, frozenset(moving_links))
     #robot_obstacle = world.robot
     if any(pairwise_collision(robot_obstacle, b) for b in obstacles): # TODO: | {obj}
-        if PRINT_FAILURES: print('Pregrasp collision failure')
+        FAILURES.fail('pregrasp', COLLISION)
         return None
     approach_conf = get_joint_positions(world.robot, world.arm_joints)
     if teleport:
         return [aq.values, approach_conf, grasp_conf]
     distance = distance_fn(grasp_conf, approach_conf)
     if MAX_CONF_DISTANCE < distance:
-        if PRINT_FAILURES: print('Pregrasp proximity failure (distance={:.5f})'.format(distance))
+        FAILURES.fail('pregrasp', PROXIMITY, distance=distance)
         return None
 
     resolutions = ARM_RESOLUTION * np.ones(len(world.arm_joints))
@@ -560,7 +563,7 @@ def plan_approach(world, approach_pose, attachments=[], obstacles=set(),
                                           disabled_collisions=world.disabled_collisions,
                                           custom_limits=world.custom_limits, resolutions=resolutions / 4.)
     if grasp_path is None:
-        if PRINT_FAILURES: print('Pregrasp path failure')
+        FAILURES.fail('pregrasp', PATH)
         return None
     if not approach_path:
         return grasp_path
@@ -575,7 +578,7 @@ def plan_approach(world, approach_pose, attachments=[], obstacles=set(),
                                       custom_limits=world.custom_limits, resolutions=resolutions,
                                       restarts=2, iterations=25, smooth=25)
     if approach_path is None:
-        if PRINT_FAILURES: print('Approach path failure')
+        FAILURES.fail('approach', PATH)
         return None
     return approach_path + grasp_path
 
@@ -596,16 +599,16 @@ def plan_workspace(world, tool_path, obstacles, randomize=True, teleport=False):
         full_arm_conf = world.solve_inverse_kinematics(tool_pose, nearby_tolerance=tolerance)
         if full_arm_conf is None:
             # TODO: this fails when teleport=True
-            if PRINT_FAILURES: print('Workspace kinematic failure')
+            FAILURES.fail('workspace', KINEMATIC)
             return None
         if any(pairwise_collision(robot_obstacle, b) for b in obstacles):
-            if PRINT_FAILURES: print('Workspace collision failure')
+            FAILURES.fail('workspace', COLLISION)
             return None
         arm_conf = get_joint_positions(world.robot, world.arm_joints)
         if arm_path and not teleport:
             distance = distance_fn(arm_path[-1], arm_conf)
             if MAX_CONF_DISTANCE < distance:
-                if PRINT_FAILURES: print('Workspace proximity failure (distance={:.5f})'.format(distance))
+                FAILURES.fail('workspace', PROXIMITY, distance=distance)
                 return None
         arm_path.append(arm_conf)
         # wait_for_user()
@@ -4,10 +4,17 @@ from pybullet_tools.utils import BodySaver, plan_nonholonomic_motion, set_render
     get_extend_fn, child_link_from_joint
 from src.command import Sequence, State, Trajectory
 from src.inference import SurfaceDist
+from src.roadmap import load_roadmap, get_context
+from src.lattice import load_lattice
 from src.stream import ARM_RESOLUTION, SELF_COLLISIONS, GRIPPER_RESOLUTION
 from src.utils import get_link_obstacles, FConf, get_descendant_obstacles
 
 PAUSE_MOTION_FAILURES = False
+ROADMAP = 'roadmap' # Persistent lazy roadmap
+LATTICE = 'lattice' # Deterministic state lattice
+RRT = 'rrt' # Randomized plan_nonholonomic_motion
+BASE_PLANNERS = [ROADMAP, LATTICE, RRT]
+BASE_PLANNER = RRT # ROADMAP and LATTICE fall back to RRT on failure
 
 def parse_fluents(world, fluents):
     obstacles = set()
@@ -65,17 +72,20 @@ def parse_fluents(world, fluents):
 # TODO: more efficient collision checking
 
 def get_base_motion_fn(world, teleport_base=False, collisions=True, teleport=False,
-                       restarts=4, iterations=75, smooth=100):
-    # TODO: lazy planning on a common base roadmap
+                       restarts=4, iterations=75, smooth=100, planner=BASE_PLANNER):
+    assert planner in BASE_PLANNERS
 
     def fn(bq1, bq2, aq, fluents=[]):
         #if bq1 == bq2:
         #    return None
         aq.assign()
         attachments, obstacles = parse_fluents(world, fluents)
-        obstacles.update(world.static_obstacles)
+        static_obstacles = world.static_obstacles
+        obstacles.update(static_obstacles)
         if not collisions:
             obstacles = set()
+        # The kitchen (including its doors) is cached per context while movable objects are checked per query
+        kitchen_obstacles = {obst for obst in obstacles if (obst in static_obstacles) or (obst[0] == world.kitchen)}
 
         start_path, end_path = [], []
         if hasattr(bq1, 'nearby_bq'):
@@ -102,11 +112,19 @@ def get_base_motion_fn(world, teleport_base=False, collisions=True, teleport=Fal
         if (bq1 == bq2) or teleport_base or teleport:
             path = [bq1.values, bq2.values]
         else:
-            # It's important that the extend function is reversible to avoid getting trapped
-            path = plan_nonholonomic_motion(world.robot, bq2.joints, bq2.values, attachments=attachments,
-                                            obstacles=obstacles, custom_limits=world.custom_limits,
-                                            reversible=True, self_collisions=False,
-                                            restarts=restarts, iterations=iterations, smooth=smooth)
+            path = None
+            if planner == LATTICE:
+                path = load_lattice(world).plan(bq1.values, bq2.values, obstacles, attachments=attachments)
+            elif planner == ROADMAP:
+                path = load_roadmap(world).plan(bq1.values, bq2.values, kitchen_obstacles,
+                                                obstacles - kitchen_obstacles, attachments=attachments,
+                                                context=(frozenset(kitchen_obstacles),) + get_context(world, fluents, aq))
+            if path is None:
+                # It's important that the extend function is reversible to avoid getting trapped
+                path = plan_nonholonomic_motion(world.robot, bq2.joints, bq2.values, attachments=attachments,
+                                                obstacles=obstacles, custom_limits=world.custom_limits,
+                                                reversible=True, self_collisions=False,
+                                                restarts=restarts, iterations=iterations, smooth=smooth)
             if path is None:
                 print('Failed to find an arm motion plan for {}->{}'.format(bq1, bq2))
                 if PAUSE_MOTION_FAILURES:
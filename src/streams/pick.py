@@ -4,8 +4,9 @@ from itertools import cycle
 from pybullet_tools.utils import BodySaver, get_sample_fn, set_joint_positions, multiply, invert, get_moving_links, \
     pairwise_collision, uniform_pose_generator, get_movable_joints, wait_for_user, INF
 from src.command import Sequence, State, ApproachTrajectory, Detach, AttachGripper
-from src.database import load_place_base_poses
-from src.stream import PRINT_FAILURES, plan_approach, MOVE_ARM, P_RANDOMIZE_IK, inverse_reachability, FIXED_FAILURES
+from src.database import load_place_base_generator, record_place
+from src.stream import plan_approach, MOVE_ARM, P_RANDOMIZE_IK, inverse_reachability, FIXED_FAILURES
+from src.failures import FAILURES, KINEMATIC, COLLISION, ATTEMPTS_EXHAUSTED
 from src.streams.move import get_gripper_motion_gen
 from src.utils import FConf, create_surface_attachment, get_surface_obstacles, iterate_approach_path
 
@@ -46,14 +47,14 @@ def plan_pick(world, obj_name, pose, grasp, base_conf, obstacles, randomize=True
     gripper_pose = multiply(world_from_body, invert(grasp.grasp_pose))  # w_f_g = w_f_o * (g_f_o)^-1
     full_grasp_conf = world.solve_inverse_kinematics(gripper_pose)
     if full_grasp_conf is None:
-        if PRINT_FAILURES: print('Grasp kinematic failure')
+        FAILURES.fail('grasp', KINEMATIC)
         return
     moving_links = get_moving_links(world.robot, world.arm_joints)
     robot_obstacle = (world.robot, frozenset(moving_links))
     #robot_obstacle = get_descendant_obstacles(world.robot, child_link_from_joint(world.arm_joints[0]))
     #robot_obstacle = world.robot
     if any(pairwise_collision(robot_obstacle, b) for b in obstacles):
-        if PRINT_FAILURES: print('Grasp collision failure')
+        FAILURES.fail('grasp', COLLISION)
         #set_renderer(enable=True)
         #wait_for_user()
         #set_renderer(enable=False)
@@ -62,7 +63,7 @@ def plan_pick(world, obj_name, pose, grasp, base_conf, obstacles, randomize=True
     approach_path = plan_approach(world, approach_pose,  # attachments=[grasp.get_attachment()],
                                   obstacles=obstacles, **kwargs)
     if approach_path is None:
-        if PRINT_FAILURES: print('Approach plan failure')
+        # plan_approach counts the reason
         return
     if MOVE_ARM:
         aq = FConf(world.robot, world.arm_joints, approach_path[0])
@@ -107,7 +108,7 @@ def get_fixed_pick_gen_fn(world, max_attempts=25, collisions=True, **kwargs):
                     yield ik_outputs
                     break  # return
             else:
-                if PRINT_FAILURES: print('Fixed pick failure after {} attempts'.format(max_attempts))
+                FAILURES.fail('fixed pick', ATTEMPTS_EXHAUSTED, attempts=max_attempts)
                 #if not pose.init:
                 #    break
                 yield None
@@ -128,7 +129,7 @@ def get_pick_gen_fn(world, max_attempts=25, collisions=True, learned=True, **kwa
         # TODO: check collisions with obj at pose
         gripper_pose = multiply(pose.get_world_from_body(), invert(grasp.grasp_pose)) # w_f_g = w_f_o * (g_f_o)^-1
         if learned:
-            base_generator = cycle(load_place_base_poses(world, gripper_pose, pose.support, grasp.grasp_type))
+            base_generator = load_place_base_generator(world, gripper_pose, pose.support, grasp.grasp_type)
         else:
             base_generator = uniform_pose_generator(world.robot, gripper_pose)
         safe_base_generator = inverse_reachability(world, base_generator, obstacles=obstacles, **kwargs)
@@ -146,10 +147,13 @@ def get_pick_gen_fn(world, max_attempts=25, collisions=True, learned=True, **kwa
                                             randomize=randomize, **kwargs), None)
                 if ik_outputs is not None:
                     print('Pick succeeded after {} attempts'.format(i))
+                    record_place(world, pose, grasp, base_conf)
+                    if learned:
+                        base_generator.record_success()
                     yield (base_conf,) + ik_outputs
                     break
             else:
-                if PRINT_FAILURES: print('Pick failure after {} attempts'.format(max_attempts))
+                FAILURES.fail('pick', ATTEMPTS_EXHAUSTED, attempts=max_attempts)
                 #if not pose.init: # Might be an intended placement blocked by a drawer
                 #    break
                 yield None
@@ -8,7 +8,8 @@ from pybullet_tools.utils import approximate_as_cylinder, approximate_as_prism,
     Point, Pose, uniform_pose_generator
 from pybullet_tools.pr2_utils import get_top_grasps
 from src.database import load_place_base_poses, load_inverse_placements, project_base_pose, load_pour_base_poses
-from src.stream import plan_approach, MOVE_ARM, inverse_reachability, P_RANDOMIZE_IK, PRINT_FAILURES
+from src.stream import plan_approach, MOVE_ARM, inverse_reachability, P_RANDOMIZE_IK
+from src.failures import FAILURES, ATTEMPTS_EXHAUSTED
 from src.command import Sequence, ApproachTrajectory, State, Wait
 from src.stream import MOVE_ARM, plan_workspace
 from src.utils import FConf, type_from_name, MUSTARD, TOP_GRASP, TOOL_POSE, set_tool_pose
@@ -162,7 +163,7 @@ def get_pour_gen_fn(world, max_attempts=50, learned=True, **kwargs):
                     yield (base_conf,) + ik_outputs
                     break
             else:
-                if PRINT_FAILURES: print('Pour failure after {} attempts'.format(max_attempts))
+                FAILURES.fail('pour', ATTEMPTS_EXHAUSTED, attempts=max_attempts)
                 #if not pose.init:
                 #    break
                 yield None
@@ -6,9 +6,10 @@ from pybullet_tools.utils import BodySaver, get_sample_fn, set_joint_positions,
     pairwise_collision, link_from_name, get_unit_vector, unit_point, Pose, get_link_pose, \
     uniform_pose_generator, INF
 from src.command import Sequence, State, ApproachTrajectory, Wait
-from src.stream import plan_approach, MOVE_ARM, inverse_reachability, P_RANDOMIZE_IK, PRINT_FAILURES, FIXED_FAILURES
+from src.stream import plan_approach, MOVE_ARM, inverse_reachability, P_RANDOMIZE_IK, FIXED_FAILURES
+from src.failures import FAILURES, ATTEMPTS_EXHAUSTED
 from src.utils import FConf, APPROACH_DISTANCE, TOOL_POSE, FINGER_EXTENT, Grasp, TOP_GRASP
-from src.database import load_pull_base_poses
+from src.database import load_pull_base_generator, record_pull
 
 def get_grasp_presses(world, knob, pre_distance=APPROACH_DISTANCE):
     knob_link = link_from_name(world.kitchen, knob)
@@ -37,11 +38,11 @@ def plan_press(world, knob_name, pose, grasp, base_conf, obstacles, randomize=Tr
     full_grasp_conf = world.solve_inverse_kinematics(gripper_pose)
     #wait_for_user()
     if full_grasp_conf is None:
-        # if PRINT_FAILURES: print('Grasp kinematic failure')
+        #FAILURES.fail('grasp', KINEMATIC)
         return
     robot_obstacle = (world.robot, frozenset(get_moving_links(world.robot, world.arm_joints)))
     if any(pairwise_collision(robot_obstacle, b) for b in obstacles):
-        #if PRINT_FAILURES: print('Grasp collision failure')
+        #FAILURES.fail('grasp', COLLISION)
         return
     approach_pose = multiply(pose, invert(grasp.pregrasp_pose))
     approach_path = plan_approach(world, approach_pose, obstacles=obstacles, **kwargs)
@@ -82,7 +83,7 @@ def get_fixed_press_gen_fn(world, max_attempts=25, collisions=True, teleport=Fal
                     yield ik_outputs
                     break  # return
             else:
-                if PRINT_FAILURES: print('Fixed pull failure after {} attempts'.format(max_attempts))
+                FAILURES.fail('fixed press', ATTEMPTS_EXHAUSTED, attempts=max_attempts)
                 yield None
                 max_failures += 1
     return gen
@@ -97,7 +98,7 @@ def get_press_gen_fn(world, max_attempts=50, collisions=True, teleport=False, le
         grasp = next(presses)
         gripper_pose = multiply(pose, invert(grasp.grasp_pose)) # w_f_g = w_f_o * (g_f_o)^-1
         if learned:
-            base_generator = cycle(load_pull_base_poses(world, knob_name))
+            base_generator = load_pull_base_generator(world, knob_name)
         else:
             base_generator = uniform_pose_generator(world.robot, gripper_pose)
         safe_base_generator = inverse_reachability(world, base_generator, obstacles=obstacles, **kwargs)
@@ -116,10 +117,13 @@ def get_press_gen_fn(world, max_attempts=50, collisions=True, teleport=False, le
                                              randomize=randomize, **kwargs), None)
                 if ik_outputs is not None:
                     print('Press succeeded after {} attempts'.format(i))
+                    record_pull(world, knob_name, base_conf)
+                    if learned:
+                        base_generator.record_success()
                     yield (base_conf,) + ik_outputs
                     break
             else:
-                if PRINT_FAILURES: print('Press failure after {} attempts'.format(max_attempts))
+                FAILURES.fail('press', ATTEMPTS_EXHAUSTED, attempts=max_attempts)
                 #if not pose.init:
                 #    break
                 yield None
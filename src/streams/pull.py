@@ -5,9 +5,10 @@ from pybullet_tools.pr2_utils import close_until_collision
 from pybullet_tools.utils import multiply, joint_from_name, set_joint_positions, invert, \
     pairwise_collision, BodySaver, uniform_pose_generator, INF
 from src.command import ApproachTrajectory, DoorTrajectory, Sequence, State
-from src.database import load_pull_base_poses
-from src.stream import PRINT_FAILURES, plan_workspace, plan_approach, MOVE_ARM, \
+from src.database import load_pull_base_generator, record_pull
+from src.stream import plan_workspace, plan_approach, MOVE_ARM, \
     P_RANDOMIZE_IK, inverse_reachability, compute_door_paths, FIXED_FAILURES
+from src.failures import FAILURES, COLLISION, ATTEMPTS_EXHAUSTED
 from src.streams.move import get_gripper_motion_gen
 from src.utils import get_descendant_obstacles, FConf
 
@@ -20,7 +21,7 @@ def is_pull_safe(world, door_joint, door_plan):
         set_joint_positions(world.kitchen, [door_joint], door_conf)
         # TODO: just check collisions with the base of the robot
         if any(pairwise_collision(world.robot, b) for b in obstacles):
-            if PRINT_FAILURES: print('Door start/end failure')
+            FAILURES.fail('door start/end', COLLISION)
             return False
     return True
 
@@ -120,7 +121,7 @@ def get_fixed_pull_gen_fn(world, max_attempts=25, collisions=True, teleport=Fals
                     yield ik_outputs
                     break  # return
             else:
-                if PRINT_FAILURES: print('Fixed pull failure')
+                FAILURES.fail('fixed pull', ATTEMPTS_EXHAUSTED, attempts=max_attempts)
                 yield None
                 failures += 1
     return gen
@@ -140,7 +141,7 @@ def get_pull_gen_fn(world, max_attempts=50, collisions=True, teleport=False, lea
         if not door_paths:
             return
         if learned:
-            base_generator = cycle(load_pull_base_poses(world, joint_name))
+            base_generator = load_pull_base_generator(world, joint_name)
         else:
             _, _, _, tool_path = door_paths[0]
             index = int(len(tool_path) / 2)  # index = 0
@@ -162,9 +163,12 @@ def get_pull_gen_fn(world, max_attempts=50, collisions=True, teleport=False, lea
                                             randomize=randomize, collisions=collisions, teleport=teleport, **kwargs), None)
                 if ik_outputs is not None:
                     print('Pull succeeded after {} attempts'.format(i))
+                    record_pull(world, joint_name, base_conf)
+                    if learned:
+                        base_generator.record_success()
                     yield (base_conf,) + ik_outputs
                     break
             else:
-                if PRINT_FAILURES: print('Pull failure')
+                FAILURES.fail('pull', ATTEMPTS_EXHAUSTED, attempts=max_attempts)
                 yield None
     return gen
\ No newline at end of file
@@ -1,11 +1,13 @@
 from __future__ import print_function
 
+import fcntl
 import os
 import numpy as np
 import string
 import math
 import random
 
+from contextlib import contextmanager
 from itertools import cycle
 from collections import namedtuple
 
@@ -17,7 +19,7 @@ from pybullet_tools.utils import joints_from_names, joint_from_name, Attachment,
     get_aabb, get_collision_data, point_from_pose, get_data_pose, get_data_extents, AABB, \
     apply_affine, get_aabb_vertices, aabb_from_points, read_obj, tform_mesh, create_attachment, draw_point, \
     child_link_from_joint, is_placed_on_aabb, pairwise_collision, flatten_links, has_link, get_difference_fn, Euler, approximate_as_prism, \
-    get_joint_positions, implies, unit_from_theta
+    get_joint_positions, implies, unit_from_theta, read_json, write_json
 
 MODELS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'models/')
 
@@ -615,4 +617,27 @@ def translate_linearly(world, distance):
     pos = np.array([x, y])
     goal_pos = pos + distance * unit_from_theta(theta)
     goal_pose = np.append(goal_pos, [theta])
-    return goal_pose
\ No newline at end of file
+    return goal_pose
+
+################################################################################
+
+LOCK_EXTENSION = '.lock'
+
+@contextmanager
+def lock_file(path):
+    # Advisory lock on a sidecar file that is held until the context exits
+    with open(path + LOCK_EXTENSION, 'a') as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield path
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+def update_json(path, update_fn):
+    # Applies update_fn to the latest saved data while other processes wait
+    with lock_file(path):
+        data = update_fn(read_json(path) if os.path.exists(path) else {})
+        temp_path = '{}.{}.tmp'.format(path, os.getpid())
+        write_json(temp_path, data)
+        os.rename(temp_path, path) # Atomic for readers that do not lock
+    return data
@@ -70,7 +70,7 @@ def add_markers(task, placements=True, forward_place=True, pull_bases=True, inve
 
     if pull_bases:
         for joint_name, color in zip(ALL_JOINTS, spaced_colors(len(ALL_JOINTS))):
-            base_confs = list(load_pull_base_poses(world, joint_name))
+            base_confs = list(load_pull_base_poses(world, joint_name, ordered=False))
             handles.extend(visualize_base_confs(world, joint_name, base_confs, color=color))
 
     #if inverse_place:
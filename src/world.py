@@ -81,6 +81,8 @@ class World(object):
     def __init__(self, robot_name=FRANKA_CARTER, use_gui=True, full_kitchen=False):
         self.task = None
         self.interface = None
+        self.current_bq = None # Most recent estimate of the base conf
+        self.stream_maps = {} # Stream maps are built once per task and stream arguments
         self.client = connect(use_gui=use_gui)
         set_real_time(False)
         #set_caching(False) # Seems to make things worse